@@ -4,7 +4,7 @@ from book_database import BookDatabase
 class Book:
     def __init__(self, database, nameTH, nameEN, author, publisher,
                  isbn, category, rating, status, location,
-                 cover=r"picApp/cover/default_cover.png"):
+                 cover=r"picApp/cover/default_cover.png", auto_add=True):
         # book's details
         self.nameTH = nameTH
         self.nameEN = nameEN
@@ -19,13 +19,15 @@ class Book:
 
         # own book database
         self.database = database
-        self.id = self.manage_id()
+        self.id = None
 
-        # add self book to database
-        self.database.add_book(self)
+        # add self book to database, bulk imports assign ids themselves
+        if auto_add:
+            self.id = self.manage_id()
+            self.database.add_book(self)
 
     def manage_id(self):
-        return str(BookDatabase.get_last_id(self.database) + 1).zfill(3)
+        return str(self.database.allocate_id()).zfill(3)
 
     @staticmethod
     def check_rating(rating):
@@ -2,12 +2,13 @@ from book_ui import BookApp
 from tkinter import messagebox
 
 
-try:
-    app = BookApp()
-    app.run()
-except Exception:
-    messagebox.showerror("Connection error",
-                         "Unable to find the server."
-                         "Please connect the internet "
-                         "to use the application")
-
+# thumbnail workers re-import this file on Windows, only the main process runs the app
+if __name__ == "__main__":
+    try:
+        app = BookApp()
+        app.run()
+    except Exception:
+        messagebox.showerror("Connection error",
+                             "Unable to find the server."
+                             "Please connect the internet "
+                             "to use the application")
@@ -1,67 +1,1112 @@
-import pygsheets as pgs
+import time
+import uuid
+from bisect import insort
+from contextlib import contextmanager
+from threading import Lock, RLock
+import numpy as np
+import pandas as pd
+from book_search import SearchIndex
+from book_storage import StorageBackend, make_storage, numerize
+from book_sync import SyncedBackend
+
+pd.options.mode.chained_assignment = None
+# column projections like bookdf[columns] share data instead of copying,
+# pandas 3 always works this way
+if int(pd.__version__.split(".")[0]) == 2:
+    pd.options.mode.copy_on_write = True
+
+HEADER = ["BookID", "Manga's Name (TH.)", "Manga's Name (ENG.)",
+          "Author", "Publisher", "ISBN", "Category",
+          "Rating", "Status", "Location", "Cover"]
+# Book attribute for each sheet column, used to read dicts and Book objects
+FIELDS = ["id", "nameTH", "nameEN", "author", "publisher", "isbn",
+          "category", "rating", "status", "location", "cover"]
+# column after HEADER that every write stamps when delta sync is on
+STAMP_COLUMN = "Updated"
+# few distinct values repeated over many rows, kept as pandas categoricals
+CATEGORY_COLUMNS = ["Author", "Publisher", "Category", "Status",
+                    "Location", "Cover"]
+
+
+def compact_frame(df):
+    """ Give a fetched sheet compact dtypes: BookID int, Rating float
+    (NaN when empty) and the low-cardinality columns categorical """
+    if "BookID" in df:
+        book_ids = pd.to_numeric(df["BookID"], errors="coerce")
+        if not book_ids.isna().any():
+            df["BookID"] = book_ids.astype("int64")
+    if "Rating" in df:
+        df["Rating"] = pd.to_numeric(df["Rating"], errors="coerce").astype("float64")
+    for column in CATEGORY_COLUMNS:
+        if column in df:
+            df[column] = df[column].astype("category")
+    return df
+
+
+def sheet_value(value):
+    """ A frame value as the sheet shows it: empty for NaN, plain Python
+    numbers, whole floats as ints """
+    if pd.isna(value):
+        return ""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def match_key(value):
+    """ Compare values the way the UI hands them back: numbers as floats
+    (4, "4" and 4.0 are the same), NaN as an empty cell and anything else
+    as stripped text """
+    if isinstance(value, float) and np.isnan(value):
+        return ""
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return value.strip()
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def narrows(query, other):
+    """ True when every book matching query surely matches other too """
+    if isinstance(other, And):
+        return all(narrows(query, part) for part in other.parts)
+    if isinstance(other, Or):
+        return any(narrows(query, part) for part in other.parts)
+    if isinstance(query, And):
+        return any(narrows(part, other) for part in query.parts)
+    if isinstance(query, Or):
+        return all(narrows(part, other) for part in query.parts)
+    return query == other or query.within(other)
+
+
+class Predicate:
+    """ A condition on one column of the book table, combine them with
+    & and | or with And(...) and Or(...) """
+    column = None
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash((type(self), self.key()))
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self.key()}"
+
+    def key(self):
+        raise NotImplementedError
+
+    def mask(self, engine, rows):
+        """ Boolean array, one per row position in rows """
+        raise NotImplementedError
+
+    def matches(self, value):
+        """ Whether one value (a match_key) passes, used for within() """
+        raise NotImplementedError
+
+    def within(self, other):
+        return False
+
+
+class Eq(Predicate):
+    def __init__(self, column, value):
+        self.column = column
+        self.value = match_key(value)
+
+    def key(self):
+        return (self.column, self.value)
+
+    def mask(self, engine, rows):
+        return engine.bitmap(self.column, self.value)[rows]
+
+    def matches(self, value):
+        return value == self.value
+
+    def within(self, other):
+        return other.column == self.column and \
+            isinstance(other, (Eq, In, Range, Contains)) and other.matches(self.value)
+
+
+class In(Predicate):
+    def __init__(self, column, values):
+        self.column = column
+        self.values = frozenset(match_key(value) for value in values)
+
+    def key(self):
+        return (self.column, self.values)
+
+    def mask(self, engine, rows):
+        return engine.value_mask(self.column, self.matches, rows)
+
+    def matches(self, value):
+        return value in self.values
+
+    def within(self, other):
+        return other.column == self.column and \
+            isinstance(other, (Eq, In, Range, Contains)) and \
+            all(other.matches(value) for value in self.values)
+
+
+class Range(Predicate):
+    """ low <= value <= high on a numeric column like Rating, either end
+    may be None """
+
+    def __init__(self, column, low=None, high=None):
+        self.column = column
+        self.low = None if low is None else float(low)
+        self.high = None if high is None else float(high)
+
+    def key(self):
+        return (self.column, self.low, self.high)
+
+    def mask(self, engine, rows):
+        numbers = engine.numbers(self.column)[rows]
+        # NaN compares False so empty and text cells never match
+        result = ~np.isnan(numbers)
+        if self.low is not None:
+            result &= numbers >= self.low
+        if self.high is not None:
+            result &= numbers <= self.high
+        return result
+
+    def matches(self, value):
+        return isinstance(value, float) and \
+            (self.low is None or value >= self.low) and \
+            (self.high is None or value <= self.high)
+
+    def within(self, other):
+        if not isinstance(other, Range) or other.column != self.column:
+            return False
+        return (other.low is None or (self.low is not None and self.low >= other.low)) and \
+            (other.high is None or (self.high is not None and self.high <= other.high))
+
+
+class Contains(Predicate):
+    """ Case-insensitive substring of the cell's text """
+
+    def __init__(self, column, text):
+        self.column = column
+        self.text = str(text).casefold()
+
+    def key(self):
+        return (self.column, self.text)
+
+    def mask(self, engine, rows):
+        return engine.value_mask(self.column, self.matches, rows)
+
+    def matches(self, value):
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return self.text in str(value).casefold()
+
+    def within(self, other):
+        # typing more of the same text
+        return isinstance(other, Contains) and other.column == self.column and \
+            other.text in self.text
+
+
+class And(Predicate):
+    def __init__(self, *parts):
+        self.parts = tuple(parts)
+
+    def key(self):
+        return self.parts
+
+    def mask(self, engine, rows):
+        result = np.ones(len(rows), dtype=bool)
+        for part in self.parts:
+            # later parts only look at rows still in
+            live = np.flatnonzero(result)
+            result[live] = part.mask(engine, rows[live])
+        return result
+
+
+class Or(Predicate):
+    def __init__(self, *parts):
+        self.parts = tuple(parts)
+
+    def key(self):
+        return self.parts
+
+    def mask(self, engine, rows):
+        result = np.zeros(len(rows), dtype=bool)
+        for part in self.parts:
+            rest = np.flatnonzero(~result)
+            result[rest] = part.mask(engine, rows[rest])
+        return result
+
+
+class QueryEngine:
+    """ Evaluates predicates over one version of the book table.
+
+    Each column is factorized into category codes once, so a predicate is
+    checked against the column's distinct values (O(groups)) and then
+    looked up by code, with a bitmap kept per value compared for
+    equality. The last result is kept too: a query that only narrows it
+    (an extra AND, a tighter range, a longer substring) is evaluated on
+    those rows alone.
+    """
+
+    def __init__(self, df, version):
+        self.df = df
+        self.version = version
+        self.all_rows = np.arange(len(df))
+        self.categories = {}    # column -> (codes, match keys of the uniques)
+        self.bitmaps = {}       # (column, key) -> bool array over all rows
+        self.number_columns = {}
+        self.last_query = None
+        self.last_mask = None
+        self.reused = 0
+
+    def codes(self, column):
+        if column not in self.categories:
+            # NaN gets a code too, it matches like an empty cell
+            codes, uniques = pd.factorize(self.df[column], use_na_sentinel=False)
+            self.categories[column] = (codes, [match_key(value) for value in uniques])
+        return self.categories[column]
+
+    def value_mask(self, column, matches, rows):
+        codes, keys = self.codes(column)
+        wanted = [code for code, key in enumerate(keys) if matches(key)]
+        return np.isin(codes[rows], wanted)
+
+    def bitmap(self, column, key):
+        if (column, key) not in self.bitmaps:
+            self.bitmaps[(column, key)] = self.value_mask(
+                column, lambda value: value == key, self.all_rows)
+        return self.bitmaps[(column, key)]
+
+    def numbers(self, column):
+        if column not in self.number_columns:
+            self.number_columns[column] = pd.to_numeric(
+                self.df[column], errors="coerce").to_numpy(dtype=float)
+        return self.number_columns[column]
+
+    def evaluate(self, query):
+        """ Boolean mask over the table's rows for query """
+        if query == self.last_query:
+            return self.last_mask
+        if self.last_query is not None and narrows(query, self.last_query):
+            self.reused += 1
+            rows = np.flatnonzero(self.last_mask)
+            mask = np.zeros(len(self.df), dtype=bool)
+            mask[rows] = query.mask(self, rows)
+        else:
+            mask = query.mask(self, self.all_rows)
+        self.last_query = query
+        self.last_mask = mask
+        return mask
+
+
+class AggregateCache:
+    """ Book counts and rating sums per group of a few columns.
+
+    Each dimension is counted over the whole table once, then kept up to
+    date row by row as books are added and edited, so a chart is built
+    from one entry per group instead of a group-by over every row. The
+    finished Series are cached by (metric, dimension) for the data
+    version they were made from.
+    """
+
+    def __init__(self, dimensions):
+        self.dimensions = list(dimensions)
+        self.groups = {}        # dimension -> {group: [count, rating sum, ratings]}
+        self.results = {}       # (metric, dimension) -> (version, Series)
+
+    def clear(self):
+        self.groups = {}
+        self.results = {}
+
+    def build(self, df, dimension):
+        groups = {}
+        ratings = pd.to_numeric(df["Rating"], errors="coerce")
+        for group, rating in zip(df[dimension], ratings):
+            self.add_to(groups, group, rating)
+        self.groups[dimension] = groups
+
+    @staticmethod
+    def add_to(groups, group, rating, sign=1):
+        if pd.isna(group):
+            return
+        totals = groups.setdefault(group, [0, 0.0, 0])
+        totals[0] += sign
+        if not pd.isna(rating):
+            totals[1] += sign * rating
+            totals[2] += sign
+        if not totals[0]:
+            del groups[group]
+
+    def add_row(self, row, sign=1):
+        """ Count a row (a Series keyed by column) in, or out with sign=-1 """
+        rating = pd.to_numeric(row["Rating"], errors="coerce")
+        for dimension, groups in self.groups.items():
+            self.add_to(groups, row[dimension], rating, sign)
+
+    def remove_row(self, row):
+        self.add_row(row, sign=-1)
+
+    def aggregate(self, df, version, metric, dimension):
+        """ "count" or "mean_rating" per group of dimension as a Series """
+        cached = self.results.get((metric, dimension))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        if dimension not in self.groups:
+            self.build(df, dimension)
+        groups = self.groups[dimension]
+        try:
+            keys = sorted(groups)
+        except TypeError:
+            # text and numbers in one column
+            keys = sorted(groups, key=str)
+        if metric == "count":
+            result = pd.Series([groups[key][0] for key in keys], index=keys,
+                               name="count", dtype="int64")
+        elif metric == "mean_rating":
+            keys = [key for key in keys if groups[key][2]]
+            result = pd.Series([groups[key][1] / groups[key][2] for key in keys],
+                               index=keys, name="Rating", dtype="float64")
+        else:
+            raise ValueError(f"Unknown metric {metric!r}, use 'count' or 'mean_rating'")
+        result.index.name = dimension
+        self.results[(metric, dimension)] = (version, result)
+        return result
 
 
 class BookDatabase:
-    def __init__(self, service_file, spreadsheet, worksheet):
-        self.google_client = pgs.authorize(service_file=service_file)
+    def __init__(self, service_file, spreadsheet, worksheet, cache_ttl=None,
+                 storage="sheets", offline=False, delta_sync=False):
+        # storage is a StorageBackend or the name of one, "sheets" or "sqlite"
+        if not isinstance(storage, StorageBackend):
+            storage = make_storage(storage, service_file)
+        if offline:
+            # writes land in a local journal, a background worker syncs them
+            storage = SyncedBackend(storage)
+        self.storage = storage
         self.spreadsheet_name = spreadsheet
         self.worksheet_name = worksheet
-        self.update_sheet(self.spreadsheet_name, self.worksheet_name)
+
+        # local copy of the worksheet, only re-downloaded when it's stale.
+        # cache_ttl (seconds) skips the revision check for that long.
+        self.bookdf = None
+        self.revision = None
+        self.fetched_at = 0
+        self.cache_ttl = cache_ttl
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # with delta_sync every write also stamps the row's Updated column,
+        # a refresh then reads that column and only the rows whose stamp
+        # changed. Edits typed straight into the sheet leave the stamp
+        # alone, a change with no new stamp falls back to a full fetch.
+        self.delta_sync = delta_sync and self.storage.delta_sync
+        # once a sheet has the column every client stamps its writes
+        self.stamping = self.delta_sync
+        self.row_stamps = {}        # row label -> its Updated stamp
+        self.delta_merges = 0
+        # bumped whenever bookdf changes, a QueryEngine is for one version
+        self.version = 0
+        self.query_engine = None
+        # chart data per group, kept up to date with each add and edit
+        self.aggregates = AggregateCache(["Publisher", "Category",
+                                          "Status", "Location"])
+
+        # edits waiting for the end of a batch(), {BookID: {column: value}}
+        self.pending_edits = {}
+        self.batch_depth = 0
+        self.edit_lock = Lock()
+
+        # BookIDs are handed out from memory, seeded from the sheet
+        self.next_id = 1
+        self.id_lock = Lock()
+
         self.findable_list = ["BookID", "Manga's Name (TH.)",
                               "Manga's Name (ENG.)", "ISBN"]
         self.filterable_list = ["Author", "Publisher", "Category",
                                 "Rating", "Status", "Location","Cover"]
+        # {findable column: {value: [row labels]}} for O(1) find_book, the
+        # labels sorted so the first row with a value is the one found
+        self.indexes = {}
+        # {findable column: SearchIndex} for search as you type
+        self.search_indexes = {}
+        # {BookID: [row labels]}, books keep their row however the IDs run
+        self.book_rows = {}
+        # database work runs on a worker thread while the pages read from
+        # the main one. bookdf is never changed in place, each change makes
+        # a new frame, and frame_lock is held while the frame and what's
+        # kept about it (indexes, aggregates, the query engine) change
+        # together and while they are read.
+        self.frame_lock = RLock()
 
-    def update_sheet(self, spreadsheet='Book collection demo', worksheet='Sheet1'):
-        self.spreadsheet = self.google_client.open(spreadsheet)
-        self.worksheet = self.spreadsheet.worksheet_by_title(worksheet)
-        self.update_df()
+        self.update_sheet(self.spreadsheet_name, self.worksheet_name)
 
-    def update_df(self):
-        self.bookdf = self.worksheet.get_as_df()
+    def update_sheet(self, spreadsheet=None, worksheet='Sheet1'):
+        # changing only the worksheet stays in the current spreadsheet
+        spreadsheet = spreadsheet or self.spreadsheet_name
+        self.storage.open(spreadsheet, worksheet)
+        self.spreadsheet_name = spreadsheet
+        self.worksheet_name = worksheet
+        self.next_id = 1
+        self.update_df(force=True)
 
-    def add_book(self, book):
-        if not self.get_last_id():
-            header = [["BookID", "Manga's Name (TH.)", "Manga's Name (ENG.)",
-                       "Author", "Publisher", "ISBN", "Category",
-                       "Rating", "Status", "Location", "Cover"]]
-            for i in range(1, len(header[0]) + 1):
-                self.worksheet.cell((1, i)).color = (204 / 255, 184 / 255, 167 / 255)
-            self.worksheet.frozen_rows = 1
-            self.worksheet.update_row(index=1, values=header)
-
-        added_cell = self.get_last_id() + 2
-        book_values = [[book.id, book.nameTH, book.nameEN,
-                        book.author, book.publisher, book.isbn,
-                        book.category, book.rating, book.status,
-                        book.location, book.cover]]
-        self.worksheet.update_row(index=added_cell, values=book_values)
-        self.update_df()
+    def update_df(self, force=False, use_ttl=True):
+        """ Re-download the sheet only when the remote copy has changed.
+        use_ttl=False always asks the storage, writes that depend on row
+        positions can't trust a copy that is only probably fresh. """
+        if not force and self.is_cache_fresh(use_ttl):
+            self.cache_hits += 1
+            return
+        self.cache_misses += 1
+        # take the revision before downloading so a concurrent change
+        # shows up as stale on the next check instead of being lost.
+        revision = self.storage.revision()
+        if not force and self.delta_sync and self.bookdf is not None \
+                and self.merge_changed_rows():
+            self.revision = revision
+            self.fetched_at = time.monotonic()
+            self.delta_merges += 1
+            self.seed_id()
+            return
+        self.revision = revision
+        df = self.split_stamps(self.storage.fetch())
+        self.set_frame(compact_frame(self.drop_blank_rows(df)))
+        self.fetched_at = time.monotonic()
+        self.seed_id()
 
-    def get_last_id(self):
-        self.update_df()
+    def merge_changed_rows(self):
+        """ Read the Updated column and merge only the rows whose stamp
+        changed since the last sync, False when a full fetch is needed """
+        if list(self.bookdf.columns) != HEADER:
+            return False
+        try:
+            stamps = [str(sheet_value(stamp))
+                      for stamp in self.storage.read_column(len(HEADER) + 1)]
+        except NotImplementedError:
+            return False
+        known = self.next_row() - 2
+        stamps += [""] * (known - len(stamps))
+        # rows past ours are read unless we know them (deleted books)
+        changed = [label for label, stamp in enumerate(stamps)
+                   if stamp != self.row_stamps.get(label, "")
+                   or (label >= known and label not in self.row_stamps)]
+        if not changed:
+            # the sheet moved without a stamp, typed in by hand or written
+            # by a copy that doesn't stamp, only a full fetch shows what
+            return False
+        if len(changed) > max(100, known // 10):
+            # most of the sheet moved (rows deleted or sorted), one fetch is cheaper
+            return False
+
+        ranges = []
+        for label in changed:
+            if ranges and sum(ranges[-1]) == label + 2:
+                ranges[-1][1] += 1
+            else:
+                ranges.append([label + 2, 1])
+        blocks = self.storage.read_row_ranges([tuple(block) for block in ranges])
+        rows = {}
+        width = len(HEADER) + 1
+        for (row, count), block in zip(ranges, blocks):
+            for offset in range(count):
+                values = list(block[offset]) if offset < len(block) else []
+                rows[row - 2 + offset] = (values + [""] * width)[:width]
+
+        added = {}
+        with self.frame_lock:
+            for label, values in rows.items():
+                self.row_stamps[label] = str(sheet_value(values.pop()))
+                if all(value in ("", None) for value in values):
+                    # a deleted book, or the sheet was compacted
+                    if label in self.bookdf.index:
+                        self.drop_row(label)
+                elif label in self.bookdf.index:
+                    self.apply_row(label, values)
+                else:
+                    added[label] = values
+            # new books keep the row they're in, blank rows may lie between
+            # them, each run of neighbours goes in with one concat
+            runs = []
+            for label in sorted(added):
+                if runs and runs[-1][0] + len(runs[-1][1]) == label:
+                    runs[-1][1].append(added[label])
+                else:
+                    runs.append((label, [added[label]]))
+            for label, run in runs:
+                self.apply_rows(label, run)
+        return True
+
+    @staticmethod
+    def drop_blank_rows(df):
+        """ Leave out the empty rows deleted books leave behind, the other
+        rows keep their labels """
+        if df.empty:
+            return df
+        columns = [column for column in HEADER if column in df]
+        blank = (df[columns].isna() | df[columns].eq("")).all(axis=1)
+        return df[~blank] if blank.any() else df
+
+    def split_stamps(self, df):
+        """ Move the Updated column of a fetched sheet into row_stamps """
+        if STAMP_COLUMN in df:
+            self.stamping = True
+            self.row_stamps = {label: str(sheet_value(stamp)) for label, stamp
+                               in zip(df.index, df.pop(STAMP_COLUMN))}
+        else:
+            self.stamping = self.delta_sync
+            self.row_stamps = {}
+            if self.stamping and not df.columns.empty:
+                # name the column before the first stamp lands in it
+                self.storage.write_header(self.sheet_header())
+        return df
+
+    def sheet_header(self):
+        if self.stamping:
+            return HEADER + [STAMP_COLUMN]
+        return HEADER
+
+    def stamped(self, label, values):
+        """ values with a new Updated stamp when the sheet has the column.
+        The stamp is remembered so our own write isn't read back. """
+        if not self.stamping:
+            return values
+        stamp = "u" + uuid.uuid4().hex[:16]
+        self.row_stamps[label] = stamp
+        return list(values) + [stamp]
+
+    def is_cache_fresh(self, use_ttl=True):
+        if self.bookdf is None:
+            return False
+        if use_ttl and self.cache_ttl is not None and \
+                time.monotonic() - self.fetched_at < self.cache_ttl:
+            return True
+        revision = self.storage.revision()
+        self.fetched_at = time.monotonic()
+        return revision == self.revision
+
+    def wrote(self):
+        """ Take the revision our own write made. Every write checks the
+        sheet right before (update_df(use_ttl=False) or locate()), anything
+        someone else wrote earlier was fetched then, so the change since
+        is ours. Without that check a write would hide theirs. """
+        if self.storage.own_writes_bump_revision:
+            self.revision = self.storage.revision()
+            self.fetched_at = time.monotonic()
+
+    def cache_info(self):
+        return {"hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "delta_merges": self.delta_merges,
+                "revision": self.revision,
+                "rows": 0 if self.bookdf is None else len(self.bookdf)}
+
+    def apply_row(self, position, values):
+        """ Write a row into the local copy the same way get_as_df reads it """
+        if self.bookdf is None or self.bookdf.columns.empty or \
+                position not in self.bookdf.index:
+            # a new row, appended like apply_rows so the dtypes stay
+            self.apply_rows(position, [values])
+            return
+        bookdf, added_df = self.conform_rows([values])
+        bookdf.loc[position] = added_df.iloc[0]
+        with self.frame_lock:
+            self.unindex_row(position)
+            self.bookdf = bookdf
+            self.version += 1
+            self.index_row(position)
+
+    def replace_rows(self, rows):
+        """ Overwrite many rows of the local copy, {label: values}, then
+        rebuild the indexes once instead of patching them row by row """
+        labels = list(rows)
+        bookdf, replaced = self.conform_rows(list(rows.values()))
+        replaced.index = labels
+        bookdf.loc[labels] = replaced
+        self.set_frame(bookdf)
+
+    def apply_rows(self, position, rows):
+        """ Append many rows to the local copy in one concat """
+        if self.bookdf is None or self.bookdf.empty:
+            bookdf = compact_frame(pd.DataFrame(
+                [numerize(row) for row in rows], columns=HEADER,
+                index=range(position, position + len(rows))))
+        else:
+            bookdf, added_df = self.conform_rows(rows)
+            added_df.index = range(position, position + len(rows))
+            bookdf = pd.concat([bookdf, added_df])
+            if not bookdf.index.is_monotonic_increasing:
+                # a row freed by a deleted book was filled again
+                bookdf = bookdf.sort_index()
+        with self.frame_lock:
+            self.bookdf = bookdf
+            self.version += 1
+            for label in range(position, position + len(rows)):
+                self.index_row(label)
+
+    def conform_rows(self, rows):
+        """ Rows as a frame with bookdf's dtypes, and a copy of bookdf
+        with their new values added to its categories so setting or
+        concatenating keeps them. bookdf itself is never changed, the
+        pages may be showing it. """
+        bookdf = self.bookdf.copy(deep=False)
+        df = pd.DataFrame([numerize(row) for row in rows], columns=bookdf.columns)
+        for column in df.columns:
+            dtype = bookdf[column].dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                new = [value for value in pd.unique(df[column])
+                       if value not in dtype.categories]
+                if new:
+                    bookdf[column] = bookdf[column].cat.add_categories(new)
+                df[column] = pd.Categorical(
+                    df[column], categories=bookdf[column].cat.categories)
+            elif pd.api.types.is_float_dtype(dtype):
+                df[column] = pd.to_numeric(df[column], errors="coerce").astype(dtype)
+            elif pd.api.types.is_integer_dtype(dtype):
+                numbers = pd.to_numeric(df[column], errors="coerce")
+                if not numbers.isna().any():
+                    df[column] = numbers.astype(dtype)
+        return bookdf, df
+
+    def memory_report(self):
+        """ Bytes used by each column of bookdf and in total, next to what
+        the same table takes with every column as plain objects """
+        if self.bookdf is None:
+            return {}
+        usage = self.bookdf.memory_usage(deep=True)
+        as_objects = self.bookdf.astype(object).memory_usage(deep=True)
+        return {"columns": {column: {"dtype": str(self.bookdf[column].dtype),
+                                     "bytes": int(usage[column]),
+                                     "object_bytes": int(as_objects[column])}
+                            for column in self.bookdf.columns},
+                "rows": len(self.bookdf),
+                "total_bytes": int(usage.sum()),
+                "object_bytes": int(as_objects.sum())}
+
+    @staticmethod
+    def index_key(value):
+        # the UI hands back strings while get_as_df numerizes, compare as text
+        return str(value)
+
+    @staticmethod
+    def book_key(book_id):
+        # 7, "007" and 7.0 are the same book
+        try:
+            return int(book_id)
+        except (TypeError, ValueError):
+            return str(book_id)
+
+    @staticmethod
+    def add_label(index, key, label):
+        insort(index.setdefault(key, []), label)
+
+    @staticmethod
+    def remove_label(index, key, label):
+        labels = index.get(key, [])
+        if label in labels:
+            labels.remove(label)
+            if not labels:
+                del index[key]
+
+    def set_frame(self, bookdf):
+        """ Make bookdf the local copy. Its indexes are built first, off
+        the lock, and swapped in with it so the pages never find a book
+        through indexes of another version. """
+        book_rows = {}
+        indexes = {}
+        search_indexes = {}
+        if "BookID" in bookdf:
+            for label, book_id in zip(bookdf.index, bookdf["BookID"]):
+                book_rows.setdefault(self.book_key(book_id), []).append(label)
+        for findable in self.findable_list:
+            index = {}
+            if findable in bookdf:
+                for label, value in zip(bookdf.index, bookdf[findable]):
+                    index.setdefault(self.index_key(value), []).append(label)
+                search_indexes[findable] = SearchIndex(bookdf[findable])
+            else:
+                search_indexes[findable] = SearchIndex()
+            indexes[findable] = index
+        with self.frame_lock:
+            self.bookdf = bookdf
+            self.version += 1
+            self.book_rows = book_rows
+            self.indexes = indexes
+            self.search_indexes = search_indexes
+            self.aggregates.clear()
+
+    def index_row(self, label):
+        row = self.bookdf.loc[label]
+        self.aggregates.add_row(row)
+        if "BookID" in row:
+            self.add_label(self.book_rows, self.book_key(row["BookID"]), label)
+        for findable, index in self.indexes.items():
+            self.add_label(index, self.index_key(row[findable]), label)
+            self.search_indexes[findable].add(row[findable])
+
+    def unindex_row(self, label):
+        row = self.bookdf.loc[label]
+        self.aggregates.remove_row(row)
+        if "BookID" in row:
+            self.remove_label(self.book_rows, self.book_key(row["BookID"]), label)
+        for findable, index in self.indexes.items():
+            self.search_indexes[findable].remove(row[findable])
+            self.remove_label(index, self.index_key(row[findable]), label)
+
+    def seed_id(self):
+        """ Reconcile the ID counter with the highest BookID in the sheet """
         try:
-            last = int(self.bookdf.BookID.iloc[-1])
-        except:
+            last = int(pd.to_numeric(self.bookdf.BookID, errors='coerce').max())
+        except (AttributeError, ValueError):
             last = 0
-        return last
+        with self.id_lock:
+            # someone else may have added books since we seeded, never reuse
+            self.next_id = max(self.next_id, last + 1)
+
+    def allocate_id(self):
+        with self.id_lock:
+            book_id = self.next_id
+            self.next_id += 1
+        return book_id
+
+    def label_of(self, bookID):
+        """ Row label of a book, KeyError when there's no such book """
+        return self.book_rows[self.book_key(bookID)][0]
+
+    def next_row(self):
+        """ Sheet row for the next new book, right after the last one. A
+        deleted book's row still holding its stamp counts as in use, the
+        storage appends below it. """
+        labels = [label for label, stamp in self.row_stamps.items() if stamp]
+        if self.bookdf is not None and not self.bookdf.empty:
+            labels.append(int(self.bookdf.index.max()))
+        return max(labels, default=-1) + 3
+
+    def rows_taken(self, row, count):
+        """ True when any of count rows from row has a book in the sheet """
+        if isinstance(self.storage, SyncedBackend):
+            # the sync worker checks rows itself when it writes
+            return False
+        return any(any(value not in ("", None) for value in values[:len(HEADER)])
+                   for values in self.storage.read_rows(row, count))
+
+    def rows_hold(self, labels):
+        """ True when the sheet still has each book of {BookID key: row
+        label} in that row """
+        if not labels or isinstance(self.storage, SyncedBackend):
+            # the sync worker compares each row with what we last saw
+            return True
+        try:
+            if len(labels) <= 50:
+                raise NotImplementedError
+            column = self.storage.read_column(1)
+            found = {label: column[label] if label < len(column) else ""
+                     for label in labels.values()}
+        except NotImplementedError:
+            blocks = self.storage.read_row_ranges([(label + 2, 1) for label in labels.values()])
+            found = {label: block[0][0] if block and block[0] else ""
+                     for label, block in zip(labels.values(), blocks)}
+        return all(self.book_key(found[label]) == key for key, label in labels.items())
+
+    def locate(self, keys):
+        """ {BookID key: row label} of the books still in the sheet, checked
+        right before a write: another copy may have compacted the sheet
+        since ours was fetched, and a stale label writes over another book """
+        self.update_df(use_ttl=False)
+        labels = {key: self.book_rows[key][0] for key in keys if key in self.book_rows}
+        if not self.rows_hold(labels):
+            self.update_df(force=True)
+            labels = {key: self.book_rows[key][0] for key in keys if key in self.book_rows}
+            if not self.rows_hold(labels):
+                raise RuntimeError("The sheet is being rearranged, try again")
+        return labels
+
+    def append_books(self, books, chunk_size=500):
+        """ Write Book objects after the last book and give those without
+        a free BookID one. Nothing is read first: the storage appends the
+        rows below whatever the sheet holds by then. Only when they don't
+        land where the local copy expected (another copy added books in
+        the meantime) is the sheet fetched and any BookID both copies
+        handed out given to our book again with a new number. """
+        taken = set(self.book_rows)
+        renumber = []
+        for book in books:
+            key = None if book.id is None else self.book_key(book.id)
+            if key is None or key in taken:
+                renumber.append(book)
+            else:
+                taken.add(key)
+        with self.id_lock:
+            first_id = self.next_id
+            self.next_id += len(renumber)
+        for offset, book in enumerate(renumber):
+            book.id = str(first_id + offset).zfill(3)
+
+        rows = [[getattr(book, field) for field in FIELDS] for book in books]
+        if self.bookdf is None or self.bookdf.empty:
+            self.storage.write_header(self.sheet_header())
+        added_cell = self.next_row()
+        landed = self.storage.append_rows(
+            added_cell, [self.stamped(added_cell - 2 + offset, row)
+                         for offset, row in enumerate(rows)], chunk_size)
+        # no check came before the write, so the revision it made isn't
+        # taken and the next check fetches what else changed
+        if landed == list(range(added_cell, added_cell + len(rows))):
+            self.apply_rows(added_cell - 2, rows)
+        else:
+            self.update_df(force=True)
+            self.renumber_taken(books, [row - 2 for row in landed])
+        return [book.id for book in books]
+
+    def renumber_taken(self, books, labels):
+        """ Give a new BookID to each of our books, just written to rows
+        labels, whose BookID another book in the sheet has too """
+        renumbered = False
+        for book, label in zip(books, labels):
+            if label not in self.bookdf.index or \
+                    len(self.book_rows.get(self.book_key(book.id), [])) < 2:
+                continue
+            book.id = str(self.allocate_id()).zfill(3)
+            values = self.row_values(label)
+            values[0] = book.id
+            self.storage.update_row(label + 2, self.stamped(label, values),
+                                    previous=self.row_values(label))
+            self.apply_row(label, values)
+            renumbered = True
+        if renumbered:
+            self.wrote()
+
+    def add_book(self, book):
+        self.append_books([book])
+
+    def add_books(self, books, chunk_size=500):
+        """ Add many books (Book objects or dicts) with contiguous IDs.
+        Rows are written in chunked range updates and the local copy
+        is refreshed once, return the list of new BookIDs. """
+        from book import Book
+
+        rows = []
+        for book in books:
+            if isinstance(book, dict):
+                book = Book(self, auto_add=False, **self.book_fields(book))
+            # IDs are handed out once the sheet has been checked
+            book.id = None
+            rows.append(book)
+        if not rows:
+            return []
+        return self.append_books(rows, chunk_size)
+
+    @staticmethod
+    def book_fields(record):
+        """ Map a dict keyed by sheet column or Book attribute to Book's arguments """
+        fields = {}
+        for column, field in zip(HEADER, FIELDS):
+            value = record.get(field, record.get(column))
+            if field == "id" or (field == "cover" and not value):
+                continue
+            fields[field] = "" if value is None else value
+        return fields
+
+    def get_last_id(self):
+        return self.next_id - 1
+
+    def row_values(self, label):
+        if self.bookdf is None or label not in self.bookdf.index:
+            return None
+        return [sheet_value(value) for value in self.bookdf.loc[label]]
+
+    def pending_writes(self):
+        # writes still waiting for the background sync in offline mode
+        if isinstance(self.storage, SyncedBackend):
+            return self.storage.pending_count()
+        return 0
 
     def edit_book(self, bookID, edited_list):
-        edited_cell = int(bookID) + 1
-        self.worksheet.update_row(index=edited_cell, values=[edited_list])
-        self.update_df()
+        self.edit_fields(bookID, dict(zip(HEADER, edited_list)))
+
+    def edit_fields(self, bookID, changes):
+        """ Change some columns of a book, {column: value}. Only the cells
+        that differ from the local copy are written, inside batch() they
+        wait and go out with the other edits in one update. """
+        label = self.label_of(bookID)
+        with self.batch():
+            self.queue_edit(label, changes)
+
+    def queue_edit(self, label, changes):
+        """ Queue the changes that differ for the book in row label, return
+        True when the book has any waiting. Edits are kept by BookID, the
+        book's row is looked up again when they're written. """
+        if label not in self.bookdf.index:
+            raise KeyError(f"No row {label + 2} in the sheet")
+        key = self.book_key(self.bookdf.at[label, "BookID"])
+        with self.edit_lock:
+            pending = self.pending_edits.setdefault(key, {})
+            for column, value in changes.items():
+                old = sheet_value(self.bookdf.at[label, column])
+                if match_key(value) != match_key(old):
+                    pending[column] = value
+                else:
+                    # an earlier edit in the batch may be undone
+                    pending.pop(column, None)
+            if not pending:
+                del self.pending_edits[key]
+            return bool(pending)
+
+    @contextmanager
+    def batch(self):
+        """ Hold every edit made inside and write them together at the end:
+
+            with database.batch():
+                database.edit_fields("012", {"Status": "Finished"})
+                database.edit_fields("013", {"Status": "Finished"})
+        """
+        with self.edit_lock:
+            self.batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self.edit_lock:
+                self.batch_depth -= 1
+                outermost = self.batch_depth == 0
+            if outermost:
+                self.flush_edits()
+
+    def bulk_update(self, predicate, changes):
+        """ Apply the same {column: value} changes to every book matching
+        predicate (None for all of them) in one batched write, return how
+        many books changed """
+        labels = self.bookdf.index if predicate is None else self.query(predicate).index
+        with self.batch():
+            changed = sum(self.queue_edit(label, changes) for label in labels)
+        return changed
+
+    def flush_edits(self):
+        with self.edit_lock:
+            edits, self.pending_edits = self.pending_edits, {}
+        if not edits:
+            return
+        labels = self.locate(edits)
+        rows = {}
+        cells = []
+        for key, changes in edits.items():
+            if key not in labels:
+                # deleted while the edit waited
+                continue
+            label = labels[key]
+            values = self.row_values(label)
+            for column, value in changes.items():
+                values[HEADER.index(column)] = value
+                cells.append((label + 2, HEADER.index(column) + 1, value))
+            rows[label] = values
+            if self.stamping:
+                cells.append((label + 2, len(HEADER) + 1,
+                              self.stamped(label, values)[-1]))
+        try:
+            self.storage.update_cells(cells)
+        except NotImplementedError:
+            for label, values in rows.items():
+                self.storage.update_row(label + 2, self.stamped(label, values),
+                                        previous=self.row_values(label))
+        self.wrote()
+        if len(rows) > 20:
+            self.replace_rows(rows)
+        else:
+            with self.frame_lock:
+                for label, values in rows.items():
+                    self.apply_row(label, values)
+
+    def delete_book(self, bookID):
+        """ Blank the book's row, a tombstone that leaves the rows below
+        where they are, and drop it from the local copy. compact() removes
+        the blank rows from the sheet later. """
+        key = self.book_key(bookID)
+        label = self.locate([key]).get(key)
+        if label is None:
+            raise KeyError(f"No book {bookID} in the sheet")
+        self.storage.update_row(label + 2, self.stamped(label, [""] * len(HEADER)),
+                                previous=self.row_values(label))
+        self.wrote()
+        self.drop_row(label)
+
+    def drop_row(self, label):
+        with self.frame_lock:
+            self.unindex_row(label)
+            self.bookdf = self.bookdf.drop(label)
+            self.version += 1
+
+    def compact(self):
+        """ Delete the blank rows left by deleted books from the sheet,
+        one delete per run of them, and return how many went. The rows
+        below each run move up, other copies pick that up on their next
+        refresh. """
+        if isinstance(self.storage, SyncedBackend):
+            raise RuntimeError("compact() deletes rows in the sheet itself, "
+                               "open the database without offline=True for it")
+        # runs worked out from a stale copy would delete live books
+        self.update_df(use_ttl=False)
+        labels = self.bookdf.index
+        end = max(int(labels.max()) + 1 if len(labels) else 0,
+                  max(self.row_stamps, default=-1) + 1)
+        kept = set(labels)
+        runs = []
+        for label in range(end):
+            if label in kept:
+                continue
+            if runs and sum(runs[-1]) == label:
+                runs[-1][1] += 1
+            else:
+                runs.append([label, 1])
+        if not runs:
+            return 0
+        # bottom run first so the row numbers of the ones above still hold
+        deleted = 0
+        for label, count in reversed(runs):
+            if self.rows_taken(label + 2, count):
+                # someone wrote there since our check, leave the run
+                continue
+            self.storage.delete_rows(label + 2, count)
+            deleted += count
+        if deleted < sum(count for label, count in runs):
+            self.update_df(force=True)
+            return deleted
+
+        moved = dict(zip(labels, range(len(labels))))
+        self.row_stamps = {moved[label]: stamp for label, stamp
+                           in self.row_stamps.items() if label in moved}
+        self.set_frame(self.bookdf.set_axis(pd.RangeIndex(len(labels))))
+        self.wrote()
+        return deleted
 
     def get_a_book(self, bookID):
-        return self.bookdf.iloc[int(bookID) - 1]
+        with self.frame_lock:
+            return self.plain_row(self.label_of(bookID))
 
     def find_book(self, findable, detail):
         # user have to choose findable and input detail return book.
-        try:
-            book = self.bookdf.iloc[self.bookdf[self.bookdf[findable] == detail].index[0]]
-        except:
-            book = 0
+        with self.frame_lock:
+            try:
+                if findable == "BookID":
+                    label = self.label_of(detail)
+                else:
+                    label = self.indexes[findable][self.index_key(detail)][0]
+                book = self.plain_row(label)
+            except KeyError:
+                book = 0
         return book
 
+    def plain_row(self, label):
+        # the row as the sheet shows it, for the pages' entries
+        return pd.Series(self.row_values(label), index=self.bookdf.columns,
+                         dtype=object, name=label)
+
     def all_findable_book(self, findable):
         if findable in self.findable_list:
             findable_list = self.bookdf[findable].unique().tolist()
@@ -71,10 +1116,18 @@ class BookDatabase:
                 findable_list.remove('-')
             return findable_list
 
+    def search(self, findable, prefix, limit=20):
+        # return up to limit values of findable column matching what user typed.
+        with self.frame_lock:
+            if findable in self.search_indexes:
+                return self.search_indexes[findable].search(prefix, limit)
+        return []
+
     def all_filterable_book(self, filterable):
         if filterable in self.filterable_list:
-            filterable_list = self.bookdf[filterable].unique().tolist()
-            return filterable_list
+            filterable_list = [sheet_value(value) for value
+                               in self.bookdf[filterable].unique().tolist()]
+            return list(dict.fromkeys(filterable_list))
 
     def selected_column(self, selected):
         return self.bookdf[selected]
@@ -82,11 +1135,24 @@ class BookDatabase:
     def filter_books(self, filterable, detail):
         # return df of filtered books.
         try:
-            filtered_bookdf = self.bookdf[self.bookdf[filterable] == detail]
-        except:
+            filtered_bookdf = self.query(Eq(filterable, detail))
+        except (KeyError, TypeError):
             filtered_bookdf = 0
         return filtered_bookdf
 
+    def query(self, query):
+        """ Return the books matching a predicate, for example
+        And(In("Status", ["Reading", "Unread"]), Range("Rating", low=4)) """
+        with self.frame_lock:
+            if self.query_engine is None or self.query_engine.version != self.version:
+                self.query_engine = QueryEngine(self.bookdf, self.version)
+            return self.bookdf[self.query_engine.evaluate(query)]
+
+    def aggregate(self, metric, dimension):
+        # "count" or "mean_rating" of the books in each group of dimension
+        with self.frame_lock:
+            return self.aggregates.aggregate(self.bookdf, self.version, metric, dimension)
+
     def all_col(self):
         # return all books' df.
         return self.bookdf.columns.tolist()
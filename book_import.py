@@ -0,0 +1,46 @@
+import argparse
+import csv
+import json
+from book_database import BookDatabase
+from cover_store import CoverStore
+
+
+def read_books(path):
+    """ Read book records from a CSV file or a JSON lines file """
+    with open(path, encoding="utf-8-sig", newline="") as file:
+        if path.lower().endswith(".csv"):
+            return list(csv.DictReader(file))
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Import books from CSV or JSON lines into the collection sheet")
+    parser.add_argument("path", help="a .csv file or a .jsonl file, "
+                                     "keyed by sheet column or Book attribute")
+    parser.add_argument("--service-file", default="keys.json")
+    parser.add_argument("--spreadsheet", default="Book collection demo")
+    parser.add_argument("--worksheet", default="Sheet1")
+    parser.add_argument("--storage", default="sheets", choices=["sheets", "sqlite"])
+    parser.add_argument("--chunk-size", type=int, default=500,
+                        help="rows written per range update")
+    args = parser.parse_args(argv)
+
+    books = read_books(args.path)
+    # cover files are stored once each and the books refer to their hash
+    cover_store = CoverStore()
+    for book in books:
+        for key in ("Cover", "cover"):
+            if book.get(key):
+                book[key] = cover_store.cover_value(book[key])
+    database = BookDatabase(args.service_file, args.spreadsheet, args.worksheet,
+                            storage=args.storage)
+    book_ids = database.add_books(books, chunk_size=args.chunk_size)
+    if book_ids:
+        print(f"Imported {len(book_ids)} books, BookID {book_ids[0]} to {book_ids[-1]}")
+    else:
+        print("No books to import")
+
+
+if __name__ == '__main__':
+    main()
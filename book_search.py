@@ -0,0 +1,135 @@
+import unicodedata
+from bisect import bisect_left, insort
+
+
+class SearchIndex:
+    """ Incremental prefix + n-gram index over one column's values.
+
+    Text is NFC normalized and casefolded, and Thai vowel/tone marks are
+    kept together with their base letter, so a partly typed Thai word
+    still lines up with the stored titles.
+    """
+
+    def __init__(self, values=(), ignored=('', '-'), gram_size=2):
+        self.ignored = set(ignored)
+        self.gram_size = gram_size
+        self.counts = {}        # display value -> number of rows using it
+        self.order = {}         # display value -> insertion order
+        self.keys = []          # sorted (normalized word start, display value)
+        self.grams = {}         # n-gram -> set of display values
+        for value in values:
+            self.add(value)
+
+    @staticmethod
+    def normalize(text):
+        return unicodedata.normalize("NFC", str(text)).casefold().strip()
+
+    @staticmethod
+    def graphemes(text):
+        """ Split text into base letters with their combining marks """
+        clusters = []
+        for char in text:
+            if clusters and unicodedata.category(char) in ("Mn", "Mc", "Me"):
+                clusters[-1] += char
+            else:
+                clusters.append(char)
+        return clusters
+
+    @staticmethod
+    def is_word_char(char):
+        # Thai vowel and tone marks aren't alphanumeric but belong to the word
+        return char.isalnum() or unicodedata.category(char).startswith("M")
+
+    def word_starts(self, text):
+        """ Every suffix of text that begins a new word """
+        starts = [text]
+        for i in range(1, len(text)):
+            if not self.is_word_char(text[i - 1]) and text[i].isalnum():
+                starts.append(text[i:])
+        return starts
+
+    def ngrams(self, text, anchored=True):
+        clusters = self.graphemes(text)
+        if anchored:
+            clusters.insert(0, "^")
+        if len(clusters) < self.gram_size:
+            return set()
+        return {"".join(clusters[i:i + self.gram_size])
+                for i in range(len(clusters) - self.gram_size + 1)}
+
+    def add(self, value):
+        display = str(value)
+        if display in self.ignored:
+            return
+        if display in self.counts:
+            self.counts[display] += 1
+            return
+        self.counts[display] = 1
+        self.order[display] = len(self.order)
+        text = self.normalize(display)
+        for start in self.word_starts(text):
+            insort(self.keys, (start, display))
+        for gram in self.ngrams(text):
+            self.grams.setdefault(gram, set()).add(display)
+
+    def remove(self, value):
+        display = str(value)
+        if display not in self.counts:
+            return
+        self.counts[display] -= 1
+        if self.counts[display]:
+            return
+        del self.counts[display]
+        del self.order[display]
+        text = self.normalize(display)
+        for start in self.word_starts(text):
+            i = bisect_left(self.keys, (start, display))
+            if i < len(self.keys) and self.keys[i] == (start, display):
+                self.keys.pop(i)
+        for gram in self.ngrams(text):
+            matches = self.grams.get(gram)
+            if matches is not None:
+                matches.discard(display)
+                if not matches:
+                    del self.grams[gram]
+
+    def search(self, prefix, limit=20):
+        """ Return up to limit values, prefix matches first then the
+        closest n-gram matches for typos or text in the middle of a title """
+        query = self.normalize(prefix)
+        if not query:
+            return sorted(self.counts, key=self.order.get)[:limit]
+
+        found = []
+        seen = set()
+        i = bisect_left(self.keys, (query, ""))
+        while i < len(self.keys) and len(found) < limit:
+            start, display = self.keys[i]
+            if not start.startswith(query):
+                break
+            if display not in seen:
+                seen.add(display)
+                found.append(display)
+            i += 1
+        if len(found) >= limit:
+            # whole-title matches before later-word matches
+            return sorted(found, key=lambda x: not self.normalize(x).startswith(query))
+
+        # a close match shares most of the query's n-grams, inside the title
+        # or not, and must then contain one of the rarest few of them
+        query_grams = self.ngrams(query, anchored=False)
+        needed = max(1, (len(query_grams) * 2 + 2) // 3)
+        rarest = sorted(query_grams, key=lambda gram: len(self.grams.get(gram, ())))
+        candidates = set()
+        for gram in rarest[:len(rarest) - needed + 1]:
+            candidates |= self.grams.get(gram, set())
+        scores = {}
+        for display in candidates - seen:
+            score = sum(display in self.grams.get(gram, ()) for gram in query_grams)
+            if score >= needed:
+                # starting the same way is a bonus
+                scores[display] = score + (display in self.grams.get(
+                    "^" + self.graphemes(query)[0], ()))
+        fuzzy = sorted(scores, key=lambda x: (-scores[x], len(x), self.order[x]))
+        found.sort(key=lambda x: not self.normalize(x).startswith(query))
+        return found + fuzzy[:limit - len(found)]
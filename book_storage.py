@@ -0,0 +1,422 @@
+import os
+import re
+import sqlite3
+from datetime import datetime, timezone
+from threading import Lock, Timer
+import pandas as pd
+
+
+def numerize(values):
+    """ Turn numeric strings into int/float the way pygsheets' get_as_df does """
+    numbers = []
+    for value in values:
+        if isinstance(value, str) and value != '':
+            try:
+                value = int(value)
+            except ValueError:
+                try:
+                    value = float(value)
+                except ValueError:
+                    pass
+        numbers.append(value)
+    return numbers
+
+
+class StorageBackend:
+    """ Where BookDatabase keeps its sheet.
+
+    Rows are numbered like a spreadsheet: row 1 is the header and the
+    books start at row 2, so BookDatabase doesn't care which one it uses.
+    """
+    name = ""
+    # True when our own writes change revision() right away
+    own_writes_bump_revision = False
+    # True when read_column is cheap enough for BookDatabase's delta sync
+    delta_sync = False
+
+    def open(self, spreadsheet, worksheet):
+        raise NotImplementedError
+
+    def fetch(self):
+        """ Return the whole sheet as a DataFrame """
+        raise NotImplementedError
+
+    def revision(self):
+        """ A cheap value that changes whenever someone else writes """
+        raise NotImplementedError
+
+    def write_header(self, header):
+        raise NotImplementedError
+
+    def update_row(self, row, values, previous=None):
+        """ previous is what the caller last saw in the row (None for a
+        new row), backends that write later use it to spot conflicts """
+        raise NotImplementedError
+
+    def update_rows(self, row, rows, chunk_size=500, previous=None):
+        """ Write a block of rows starting at row """
+        raise NotImplementedError
+
+    def append_rows(self, row, rows, chunk_size=500):
+        """ Write rows below the last row in use from row down, placed by
+        the storage in the same request so rows another copy appends at
+        the same time never land on them. Return the sheet row of each. """
+        raise NotImplementedError
+
+    def update_cells(self, cells):
+        """ Write single cells, (row, column, value) with column 1 for A,
+        in one request. Backends without it get whole rows instead. """
+        raise NotImplementedError
+
+    def delete_rows(self, row, count):
+        """ Remove count rows from row, the rows below move up """
+        raise NotImplementedError
+
+    def read_rows(self, row, count):
+        """ Return the values of count rows from row, short rows for empty ones """
+        raise NotImplementedError
+
+    def read_row_ranges(self, ranges):
+        """ read_rows for each (row, count) in ranges """
+        return [self.read_rows(row, count) for row, count in ranges]
+
+    def read_column(self, column):
+        """ Return the values of column (1 is A) from row 2 down,
+        empty cells at the end may be left out """
+        raise NotImplementedError
+
+
+class SheetsSession:
+    """ One authorized pygsheets client per service file, shared by every
+    GoogleSheetBackend.
+
+    The client's HTTP connection is kept alive and reused, spreadsheets
+    are kept once opened (they carry their id and worksheet handles, so
+    switching back to a sheet skips the Drive search), and the access
+    token is refreshed from a timer thread before it runs out.
+    """
+    sessions = {}
+    sessions_lock = Lock()
+
+    @classmethod
+    def get(cls, service_file):
+        with cls.sessions_lock:
+            if service_file not in cls.sessions:
+                cls.sessions[service_file] = cls(service_file)
+            return cls.sessions[service_file]
+
+    def __init__(self, service_file, timeout=30, refresh_margin=300):
+        import httplib2
+        import pygsheets as pgs
+        self.client = pgs.authorize(service_file=service_file,
+                                    http=httplib2.Http(timeout=timeout))
+        self.spreadsheets = {}
+        self.refresh_margin = refresh_margin
+        self.refresh_timer = None
+        self.refresh_credentials()
+
+    def open(self, spreadsheet):
+        if spreadsheet not in self.spreadsheets:
+            self.spreadsheets[spreadsheet] = self.client.open(spreadsheet)
+        return self.spreadsheets[spreadsheet]
+
+    def forget(self, spreadsheet):
+        self.spreadsheets.pop(spreadsheet, None)
+
+    def refresh_credentials(self):
+        import httplib2
+        from google_auth_httplib2 import Request
+        credentials = self.client.oauth
+        try:
+            # its own connection, the client's may be busy on another thread
+            credentials.refresh(Request(httplib2.Http()))
+            now = datetime.now(timezone.utc).replace(tzinfo=None)
+            delay = (credentials.expiry - now).total_seconds() - self.refresh_margin
+        except Exception:
+            # offline, try again soon, requests still refresh on their own
+            delay = 60
+        self.refresh_timer = Timer(max(delay, 30), self.refresh_credentials)
+        self.refresh_timer.daemon = True
+        self.refresh_timer.start()
+
+
+class GoogleSheetBackend(StorageBackend):
+    name = "sheets"
+    own_writes_bump_revision = True
+    delta_sync = True
+
+    def __init__(self, service_file):
+        self.session = SheetsSession.get(service_file)
+        self.google_client = self.session.client
+        self.spreadsheet = None
+        self.worksheet = None
+
+    def open(self, spreadsheet, worksheet):
+        # both are kept only once both opened, a sheet that can't be found
+        # leaves the backend reading, writing and watching the old one
+        try:
+            opened = self.session.open(spreadsheet)
+            sheet = opened.worksheet_by_title(worksheet)
+        except Exception:
+            # the cached spreadsheet may have been renamed or deleted
+            self.session.forget(spreadsheet)
+            opened = self.session.open(spreadsheet)
+            sheet = opened.worksheet_by_title(worksheet)
+        self.spreadsheet = opened
+        self.worksheet = sheet
+
+    def fetch(self):
+        return self.worksheet.get_as_df()
+
+    def revision(self):
+        # modifiedTime from Drive is a metadata call, much cheaper than get_as_df
+        return self.spreadsheet.updated
+
+    def grow(self, rows=0, cols=0):
+        """ Add rows and columns to the grid as it is now. Setting
+        worksheet.rows or cols resizes to an absolute size from the grid
+        cached with the handle, which drops whatever another copy has
+        added since. """
+        requests = [{"appendDimension": {"sheetId": self.worksheet.id,
+                                         "dimension": dimension, "length": length}}
+                    for dimension, length in (("ROWS", rows), ("COLUMNS", cols))
+                    if length > 0]
+        if requests:
+            self.google_client.sheet.batch_update(self.spreadsheet.id, requests)
+            self.worksheet.refresh()
+
+    def write_header(self, header):
+        if self.worksheet.cols < len(header):
+            self.worksheet.refresh()
+            self.grow(cols=len(header) - self.worksheet.cols)
+        for i in range(1, len(header) + 1):
+            self.worksheet.cell((1, i)).color = (204 / 255, 184 / 255, 167 / 255)
+        self.worksheet.frozen_rows = 1
+        self.worksheet.update_row(index=1, values=[header])
+
+    def update_row(self, row, values, previous=None):
+        self.worksheet.update_row(index=row, values=[values])
+
+    def update_rows(self, row, rows, chunk_size=500, previous=None):
+        last_row = row + len(rows) - 1
+        if self.worksheet.rows < last_row:
+            # the cached grid size may be behind the sheet's
+            self.worksheet.refresh()
+            self.grow(rows=last_row - self.worksheet.rows)
+        for start in range(0, len(rows), chunk_size):
+            self.worksheet.update_values(crange=f"A{row + start}",
+                                         values=rows[start:start + chunk_size])
+
+    def append_rows(self, row, rows, chunk_size=500):
+        # values.append looks for the table from row down and inserts the
+        # rows below it, the grid grows with them
+        title = self.worksheet.title.replace("'", "''")
+        landed = []
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            response = self.google_client.sheet.values_append(
+                self.spreadsheet.id, chunk, "ROWS",
+                range=f"'{title}'!A{(landed[-1] + 1) if landed else row}",
+                insertDataOption="INSERT_ROWS")
+            first = int(re.search(r"![A-Z]+(\d+)",
+                                  response["updates"]["updatedRange"]).group(1))
+            landed += range(first, first + len(chunk))
+        return landed
+
+    def update_cells(self, cells):
+        # neighbouring cells of a row go in one range, every range in one call
+        ranges = []
+        values = []
+        for row, column, value in sorted(cells, key=lambda cell: cell[:2]):
+            if ranges and ranges[-1][1] == (row, column - 1):
+                ranges[-1][1] = (row, column)
+                values[-1][0].append(value)
+            else:
+                ranges.append([(row, column), (row, column)])
+                values.append([[value]])
+        if ranges:
+            self.worksheet.update_values_batch([tuple(cells) for cells in ranges], values)
+
+    def delete_rows(self, row, count):
+        self.worksheet.delete_rows(row, count)
+
+    def read_rows(self, row, count):
+        if row + count - 1 > self.worksheet.rows:
+            # rows other copies added lie past the grid size cached with the handle
+            self.worksheet.refresh()
+        last_row = min(row + count - 1, self.worksheet.rows)
+        if last_row < row:
+            return []
+        return self.worksheet.get_values((row, 1), (last_row, self.worksheet.cols),
+                                         include_tailing_empty=False,
+                                         include_tailing_empty_rows=True)
+
+    def read_row_ranges(self, ranges):
+        # every range in one values:batchGet call
+        if not ranges:
+            return []
+        if max(row + count - 1 for row, count in ranges) > self.worksheet.rows:
+            self.worksheet.refresh()
+        last_column = self.worksheet.cols
+        return self.worksheet.get_values_batch(
+            [((row, 1), (row + count - 1, last_column)) for row, count in ranges])
+
+    def read_column(self, column):
+        return self.worksheet.get_col(column, include_tailing_empty=False)[1:]
+
+
+class SQLiteBackend(StorageBackend):
+    """ Local sheet in a SQLite file, <spreadsheet>.sqlite3 with a table
+    per worksheet. Works offline and every call is a local one. """
+    name = "sqlite"
+    delta_sync = True
+    indexed_columns = ["BookID", "ISBN", "Author", "Publisher"]
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.connection = None
+        self.table = None
+        self.lock = Lock()
+
+    def open(self, spreadsheet, worksheet):
+        if self.connection is not None:
+            self.connection.close()
+        path = os.path.join(self.directory, f"{spreadsheet}.sqlite3")
+        # pages run database tasks from worker threads, self.lock serializes them
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.table = worksheet
+
+    @staticmethod
+    def quote(name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def columns(self):
+        info = self.connection.execute(
+            f"PRAGMA table_info({self.quote(self.table)})").fetchall()
+        return [column[1] for column in info if column[1] != "row_no"]
+
+    def fetch(self):
+        with self.lock:
+            columns = self.columns()
+            if not columns:
+                return pd.DataFrame()
+            names = ", ".join(self.quote(column) for column in columns)
+            rows = self.connection.execute(
+                f"SELECT row_no, {names} FROM {self.quote(self.table)} "
+                f"ORDER BY row_no").fetchall()
+        return pd.DataFrame([row[1:] for row in rows], columns=columns,
+                            index=[row[0] - 2 for row in rows])
+
+    def revision(self):
+        with self.lock:
+            # bumps whenever another connection commits to the file, not for ours
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def write_header(self, header):
+        table = self.quote(self.table)
+        # columns have no declared type so ints, floats and text keep their type
+        columns = ", ".join(self.quote(column) for column in header)
+        with self.lock, self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                    f"(row_no INTEGER PRIMARY KEY, {columns})")
+            existing = self.columns()
+            for column in header:
+                if column not in existing:
+                    self.connection.execute(f"ALTER TABLE {table} "
+                                            f"ADD COLUMN {self.quote(column)}")
+            for column in self.indexed_columns:
+                if column in header:
+                    index = self.quote(f"{self.table}_{column}")
+                    self.connection.execute(f"CREATE INDEX IF NOT EXISTS {index} "
+                                            f"ON {table} ({self.quote(column)})")
+
+    def update_row(self, row, values, previous=None):
+        self.update_rows(row, [values])
+
+    def update_rows(self, row, rows, chunk_size=500, previous=None):
+        with self.lock:
+            columns = self.columns()
+            names = ", ".join(["row_no"] + [self.quote(column) for column in columns])
+            marks = ", ".join("?" * (len(columns) + 1))
+            with self.connection:
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO {self.quote(self.table)} ({names}) "
+                    f"VALUES ({marks})",
+                    # short rows leave the columns past them empty
+                    [[row + offset] + (numerize(values) + [None] * len(columns))[:len(columns)]
+                     for offset, values in enumerate(rows)])
+
+    def append_rows(self, row, rows, chunk_size=500):
+        table = self.quote(self.table)
+        with self.lock:
+            columns = self.columns()
+            names = ", ".join(["row_no"] + [self.quote(column) for column in columns])
+            marks = ", ".join("?" * (len(columns) + 1))
+            in_use = " OR ".join(f"COALESCE({self.quote(column)}, '') != ''"
+                                 for column in columns)
+            with self.connection:
+                # hold the write lock from finding the last row to writing
+                self.connection.execute("BEGIN IMMEDIATE")
+                last_row = self.connection.execute(
+                    f"SELECT MAX(row_no) FROM {table} WHERE row_no >= ? AND ({in_use})",
+                    (row,)).fetchone()[0]
+                first = row if last_row is None else last_row + 1
+                self.connection.executemany(
+                    f"INSERT OR REPLACE INTO {table} ({names}) VALUES ({marks})",
+                    [[first + offset] + (numerize(values) + [None] * len(columns))[:len(columns)]
+                     for offset, values in enumerate(rows)])
+        return list(range(first, first + len(rows)))
+
+    def update_cells(self, cells):
+        table = self.quote(self.table)
+        with self.lock:
+            columns = self.columns()
+            with self.connection:
+                for row, column, value in cells:
+                    self.connection.execute(
+                        f"UPDATE {table} SET {self.quote(columns[column - 1])} = ? "
+                        f"WHERE row_no = ?", (numerize([value])[0], row))
+
+    def delete_rows(self, row, count):
+        table = self.quote(self.table)
+        with self.lock, self.connection:
+            self.connection.execute(f"DELETE FROM {table} WHERE row_no BETWEEN ? AND ?",
+                                    (row, row + count - 1))
+            # through negative numbers, shifting in place would collide
+            self.connection.execute(f"UPDATE {table} SET row_no = -(row_no - ?) "
+                                    f"WHERE row_no > ?", (count, row + count - 1))
+            self.connection.execute(f"UPDATE {table} SET row_no = -row_no "
+                                    f"WHERE row_no < 0")
+
+    def read_rows(self, row, count):
+        with self.lock:
+            columns = self.columns()
+            if not columns:
+                # no table until the header is written
+                return [[] for _ in range(count)]
+            names = ", ".join(self.quote(column) for column in columns)
+            found = dict((values[0], list(values[1:])) for values in self.connection.execute(
+                f"SELECT row_no, {names} FROM {self.quote(self.table)} "
+                f"WHERE row_no BETWEEN ? AND ?", (row, row + count - 1)))
+        return [found.get(row_no, []) for row_no in range(row, row + count)]
+
+    def read_column(self, column):
+        with self.lock:
+            columns = self.columns()
+            if column > len(columns):
+                return []
+            found = dict(self.connection.execute(
+                f"SELECT row_no, {self.quote(columns[column - 1])} "
+                f"FROM {self.quote(self.table)} WHERE row_no >= 2"))
+        last_row = max(found, default=1)
+        return ["" if found.get(row_no) is None else found[row_no]
+                for row_no in range(2, last_row + 1)]
+
+
+def make_storage(name, service_file="keys.json"):
+    """ Build the backend chosen at startup, "sheets" or "sqlite" """
+    if name == SQLiteBackend.name:
+        return SQLiteBackend()
+    if name == GoogleSheetBackend.name:
+        return GoogleSheetBackend(service_file)
+    raise ValueError(f"Unknown storage {name!r}, use 'sheets' or 'sqlite'")
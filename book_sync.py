@@ -0,0 +1,400 @@
+import json
+import os
+import random
+from threading import Event, Lock, Thread
+import pandas as pd
+from book_storage import StorageBackend, numerize
+
+
+class WriteJournal:
+    """ Append-only JSON lines file of writes that haven't reached the
+    remote yet. Every append is fsync'ed so a crash or a closed laptop
+    doesn't lose a book, and the acknowledged sequence number is kept
+    next to it in <journal>.acked. """
+
+    def __init__(self, path):
+        self.path = path
+        self.acked_path = path + ".acked"
+        self.lock = Lock()
+        self.ops = []
+        self.acked = 0
+        if os.path.exists(self.acked_path):
+            with open(self.acked_path, encoding="utf-8") as file:
+                self.acked = int(file.read().strip() or 0)
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # half written last line from a crash, never acked
+                        continue
+                    if op["seq"] > self.acked:
+                        self.ops.append(op)
+        self.next_seq = max([self.acked] + [op["seq"] for op in self.ops]) + 1
+
+    def append(self, op):
+        with self.lock:
+            op = dict(op, seq=self.next_seq)
+            self.next_seq += 1
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(op, ensure_ascii=False, default=self.plain) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            self.ops.append(op)
+        return op
+
+    @staticmethod
+    def plain(value):
+        # numpy numbers from the DataFrame
+        return value.item() if hasattr(value, "item") else str(value)
+
+    def pending(self):
+        with self.lock:
+            return list(self.ops)
+
+    def ack(self, seq):
+        with self.lock:
+            self.ops = [op for op in self.ops if op["seq"] > seq]
+            self.acked = max(self.acked, seq)
+            temp_path = self.acked_path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as file:
+                file.write(str(self.acked))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.acked_path)
+            if not self.ops:
+                # everything reached the remote, start a fresh file
+                open(self.path, "w", encoding="utf-8").close()
+
+
+class SyncedBackend(StorageBackend):
+    """ Offline-first wrapper around another backend.
+
+    Writes go to a WriteJournal and return at once, a SyncWorker thread
+    flushes them to the remote in batches. Reads fall back to the last
+    snapshot when the remote can't be reached, and pending writes are
+    replayed on top of whatever was read so the local copy stays ahead.
+    """
+
+    def __init__(self, remote, directory=".book_sync"):
+        os.makedirs(directory, exist_ok=True)
+        self.remote = remote
+        self.name = remote.name
+        self.directory = directory
+        self.journal = WriteJournal(os.path.join(directory, "journal.jsonl"))
+        self.conflicts_path = os.path.join(directory, "conflicts.jsonl")
+        self.remote_lock = Lock()
+        self.remote_sheet = None
+        self.sheet = None
+        self.reported_revision = None
+        self.own_revision = None
+        self.stale = False
+        self.headers = {}
+        # last fetched frame plus the writes synced since, saved as a pickle
+        self.snapshot = None
+        self.snapshot_sheet = None
+        self.snapshot_lock = Lock()
+        self.online = False
+        self.worker = SyncWorker(self)
+        self.worker.start()
+
+    def ensure_open(self, sheet):
+        """ Point the remote at sheet, call with remote_lock held """
+        if self.remote_sheet != sheet:
+            self.remote.open(*sheet)
+            self.remote_sheet = sheet
+
+    def open(self, spreadsheet, worksheet):
+        sheet = (spreadsheet, worksheet)
+        try:
+            with self.remote_lock:
+                self.ensure_open(sheet)
+        except Exception:
+            # offline, fetch() will serve the snapshot. A sheet without one
+            # may not exist at all, stay on the open one.
+            if not os.path.exists(self.snapshot_path(sheet)):
+                raise
+            self.online = False
+        self.sheet = sheet
+        self.reported_revision = None
+        self.own_revision = None
+        self.stale = False
+        self.snapshot = None
+        self.snapshot_sheet = None
+
+    def snapshot_path(self, sheet=None):
+        name = "-".join(sheet or self.sheet).replace(os.sep, "_")
+        return os.path.join(self.directory, f"{name}.snapshot.pkl")
+
+    def fetch(self):
+        try:
+            with self.remote_lock:
+                self.ensure_open(self.sheet)
+                df = self.remote.fetch()
+            self.online = True
+            with self.snapshot_lock:
+                self.snapshot = df
+                self.snapshot_sheet = self.sheet
+                self.snapshot.to_pickle(self.snapshot_path())
+        except Exception:
+            self.online = False
+            with self.snapshot_lock:
+                if self.snapshot_sheet != self.sheet:
+                    if not os.path.exists(self.snapshot_path()):
+                        raise
+                    self.snapshot = pd.read_pickle(self.snapshot_path())
+                    self.snapshot_sheet = self.sheet
+        with self.snapshot_lock:
+            return self.replay(self.snapshot.copy(), self.journal.pending())
+
+    def synced(self, ops):
+        """ Mark ops as written and keep the snapshot in step with them """
+        with self.snapshot_lock:
+            try:
+                if self.snapshot_sheet == self.sheet:
+                    self.snapshot = self.replay(self.snapshot, ops)
+            finally:
+                # the remote has them either way, never write them twice
+                self.journal.ack(ops[-1]["seq"])
+
+    def save_snapshot(self):
+        with self.snapshot_lock:
+            if self.snapshot_sheet == self.sheet:
+                self.snapshot.to_pickle(self.snapshot_path())
+
+    def replay(self, df, ops):
+        """ Apply journal ops for the open sheet to a fetched frame """
+        if not df.columns.empty:
+            self.headers[self.sheet] = df.columns.tolist()
+        for op in ops:
+            if tuple(op["sheet"]) != self.sheet:
+                continue
+            if op["kind"] == "header":
+                self.headers[self.sheet] = op["header"]
+                continue
+            if df.columns.empty:
+                if self.sheet not in self.headers:
+                    # snapshot of an empty sheet, rows show up once synced
+                    continue
+                df = pd.DataFrame(columns=self.headers[self.sheet])
+            if (df.dtypes != object).any():
+                # a typed column (BookID int64, Rating float) can't take the
+                # text of a journaled row or the blanks of a deleted book
+                df = df.astype(object)
+            for offset, values in enumerate(op["rows"]):
+                df.loc[op["row"] + offset - 2] = numerize(values)
+        return df.sort_index()
+
+    def revision(self):
+        try:
+            with self.remote_lock:
+                self.ensure_open(self.sheet)
+                revision = self.remote.revision()
+            self.online = True
+        except Exception:
+            # can't tell while offline, keep using the local copy
+            self.online = False
+            return self.reported_revision
+        # our own syncs bump the remote revision too, those aren't news
+        # unless someone else wrote in between or a sync hit a conflict
+        if revision != self.own_revision or self.stale:
+            self.reported_revision = revision
+            self.stale = False
+        return self.reported_revision
+
+    def write_header(self, header):
+        self.headers[self.sheet] = list(header)
+        self.journal.append({"sheet": list(self.sheet), "kind": "header",
+                             "header": list(header)})
+        self.worker.wake()
+
+    def update_row(self, row, values, previous=None):
+        self.update_rows(row, [values],
+                         previous=None if previous is None else [previous])
+
+    def update_rows(self, row, rows, chunk_size=500, previous=None):
+        self.journal.append({"sheet": list(self.sheet), "kind": "rows", "row": row,
+                             "rows": [list(values) for values in rows],
+                             "previous": previous})
+        self.worker.wake()
+
+    def append_rows(self, row, rows, chunk_size=500):
+        # the worker moves a new book below the sheet's rows if its row is taken
+        self.update_rows(row, rows)
+        return list(range(row, row + len(rows)))
+
+    def read_rows(self, row, count):
+        with self.remote_lock:
+            return self.remote.read_rows(row, count)
+
+    def pending_count(self):
+        return len(self.journal.pending())
+
+    def log_conflict(self, op, remote_rows, resolution):
+        self.stale = True
+        with open(self.conflicts_path, "a", encoding="utf-8") as file:
+            file.write(json.dumps({"op": op, "remote": remote_rows,
+                                   "resolution": resolution},
+                                  ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        self.worker.stop()
+
+
+class SyncWorker(Thread):
+    """ Flush the journal to the remote with batching and retry/backoff """
+
+    def __init__(self, backend, batch_size=500, base_delay=2, max_delay=300):
+        Thread.__init__(self, daemon=True)
+        self.backend = backend
+        self.batch_size = batch_size
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.wake_event = Event()
+        self.stop_event = Event()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def wake(self):
+        self.wake_event.set()
+
+    def stop(self):
+        self.stop_event.set()
+        self.wake_event.set()
+
+    def run(self):
+        while not self.stopped:
+            self.wake_event.clear()
+            if not self.backend.journal.pending():
+                self.wake_event.wait()
+                continue
+            try:
+                self.flush()
+                self.backend.save_snapshot()
+                self.failures = 0
+                self.backend.online = True
+            except Exception:
+                self.failures += 1
+                self.backend.online = False
+                delay = min(self.max_delay,
+                            self.base_delay * 2 ** (self.failures - 1))
+                # new writes don't cut the backoff short, only stop() does
+                self.stop_event.wait(delay * random.uniform(0.8, 1.2))
+
+    @staticmethod
+    def same_rows(first, second):
+        width = max(len(first), len(second))
+        first = numerize([str(v) for v in first] + [''] * (width - len(first)))
+        second = numerize([str(v) for v in second] + [''] * (width - len(second)))
+        return first == second
+
+    def batch(self):
+        """ Take the next run of ops for one sheet, merging contiguous rows """
+        ops = self.backend.journal.pending()[:self.batch_size]
+        sheet = ops[0]["sheet"]
+        if ops[0]["kind"] == "header":
+            return sheet, ops[:1]
+        batch = [ops[0]]
+        for op in ops[1:]:
+            last = batch[-1]
+            if op["sheet"] != sheet or op["kind"] != "rows" or \
+                    op["row"] != last["row"] + len(last["rows"]):
+                break
+            batch.append(op)
+        return sheet, batch
+
+    def flush(self):
+        remote = self.backend.remote
+        while self.backend.journal.pending() and not self.stopped:
+            sheet, ops = self.batch()
+            with self.backend.remote_lock:
+                self.backend.ensure_open(tuple(sheet))
+                open_sheet = tuple(sheet) == self.backend.sheet
+                if open_sheet:
+                    revision = remote.revision()
+                    if revision not in (self.backend.own_revision,
+                                        self.backend.reported_revision):
+                        # someone else wrote since we last looked
+                        self.backend.stale = True
+                self.write(ops)
+                if open_sheet:
+                    self.backend.own_revision = remote.revision()
+            self.backend.synced(ops)
+
+    def write(self, ops):
+        remote = self.backend.remote
+        if ops[0]["kind"] == "header":
+            remote.write_header(ops[0]["header"])
+            return
+
+        first_row = ops[0]["row"]
+        count = sum(len(op["rows"]) for op in ops)
+        remote_rows = remote.read_rows(first_row, count)
+        rows = []
+        moved = False
+        for op in ops:
+            for offset, values in enumerate(op["rows"]):
+                row = op["row"] + offset
+                if moved:
+                    # an earlier row was moved into the free space
+                    current = (remote.read_rows(row, 1) or [[]])[0]
+                else:
+                    index = row - first_row
+                    current = remote_rows[index] if index < len(remote_rows) else []
+                expected = op["previous"][offset] if op["previous"] else None
+                values = self.resolve(op, row, values, current, expected)
+                moved = moved or (values is None and expected is None)
+                rows.append(values)
+        if None not in rows:
+            remote.update_rows(first_row, rows)
+        else:
+            for offset, values in enumerate(rows):
+                if values is not None:
+                    remote.update_row(first_row + offset, values)
+
+    def resolve(self, op, row, values, current, expected):
+        """ Return the values to write, or None to leave the remote row """
+        if self.same_rows(current, values):
+            return values
+        if expected is None:
+            # a new book, the row must still be empty
+            if not any(str(v) for v in current):
+                return values
+            new_row = self.find_empty_row(row)
+            values = self.free_book_id(values)
+            self.backend.remote.update_row(new_row, values)
+            self.backend.log_conflict(op, current, f"moved to row {new_row} "
+                                                   f"as BookID {values[0]}")
+            return None
+        if self.same_rows(current, expected):
+            return values
+        # someone else edited the same book since we read it, theirs wins
+        self.backend.log_conflict(op, current, "kept remote")
+        return None
+
+    def free_book_id(self, values):
+        """ values with a new BookID when another book already has theirs,
+        the book in the row we wanted was most likely given the same one """
+        try:
+            ids = numerize([str(value) for value in self.backend.remote.read_column(1)])
+        except NotImplementedError:
+            return values
+        book_id = numerize([str(values[0])])[0]
+        if book_id not in ids:
+            return values
+        numbers = [value for value in ids if isinstance(value, int)]
+        return [str(max(numbers, default=0) + 1).zfill(3)] + list(values[1:])
+
+    def find_empty_row(self, row, block=100):
+        remote = self.backend.remote
+        while True:
+            rows = remote.read_rows(row, block)
+            for offset in range(block):
+                values = rows[offset] if offset < len(rows) else []
+                if not any(str(v) for v in values):
+                    return row + offset
+            row += block
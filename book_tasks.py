@@ -0,0 +1,57 @@
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from queue import Empty, Queue
+
+
+class TaskExecutor:
+    """ Shared executor for slow database work.
+
+    Tasks run on a worker thread and return a Future that can be cancelled
+    while it's still queued. Their callbacks are passed back through a
+    queue that the Tk main loop drains with after(), so callbacks are free
+    to touch widgets. One worker by default keeps writes to the sheet in
+    the order the user made them.
+    """
+
+    def __init__(self, root, max_workers=1, poll_ms=50):
+        self.root = root
+        self.pool = ThreadPoolExecutor(max_workers=max_workers,
+                                       thread_name_prefix="book-task")
+        self.finished = Queue()
+        self.poll_ms = poll_ms
+        self.poll()
+
+    def submit(self, task, *args, on_done=None, on_error=None):
+        """ Run task(*args) off the main thread. on_done(result) or
+        on_error(exception) is then called on the main thread, a cancelled
+        task reports a CancelledError to on_error. """
+        future = self.pool.submit(task, *args)
+        future.add_done_callback(
+            lambda done: self.finished.put((done, on_done, on_error)))
+        return future
+
+    def poll(self):
+        while True:
+            try:
+                future, on_done, on_error = self.finished.get_nowait()
+            except Empty:
+                break
+            try:
+                if future.cancelled():
+                    error = CancelledError()
+                else:
+                    error = future.exception()
+                if error is None:
+                    if on_done is not None:
+                        on_done(future.result())
+                elif on_error is not None:
+                    on_error(error)
+                elif not isinstance(error, CancelledError):
+                    raise error
+            except Exception as error:
+                # same place Tk reports errors from its own callbacks
+                self.root.report_callback_exception(type(error), error,
+                                                    error.__traceback__)
+        self.root.after(self.poll_ms, self.poll)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
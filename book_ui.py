@@ -1,21 +1,23 @@
+import time
+# startup timings are measured from here, before the heavy imports
+STARTED_AT = time.perf_counter()
 from tkinter import *
 from tkinter.ttk import Combobox, Progressbar
 from tkinter import messagebox
 from tkinter.filedialog import askopenfilename
 from webbrowser import open_new
-from book_database import BookDatabase
-from book import Book
-from pandastable import Table
+import os
+from book_tasks import TaskExecutor
+from cover_cache import CoverCache, DEFAULT_COVER
+from cover_store import CoverStore
+from thumbnails import Thumbnails
+from concurrent.futures import CancelledError
 from copy import copy
-import pandas as pd
-import matplotlib
-import seaborn as sns
-from threading import Thread
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
 
-matplotlib.use('TkAgg')
-pd.options.mode.chained_assignment = None
+# pandas, pandastable, matplotlib and seaborn take seconds to import, so
+# they are imported where they're first used instead of up here: the
+# database (and pandas with it) on the loading thread, the table and
+# graph libraries when their pages are built
 
 
 class BookApp(Tk):
@@ -25,8 +27,18 @@ class BookApp(Tk):
         Tk.__init__(self, *args)
         self.title("Book collection project (API edition)")
         self.frames = {}
+        self.container = None
+        # (step, seconds since STARTED_AT), see startup_report()
+        self.timings = []
+        self.mark("imports")
         self.app_width = 1280
         self.app_height = 720
+        # every page runs its database work here, off the Tk main thread
+        self.executor = TaskExecutor(self)
+        # decoded covers shared by the pages that show them
+        self.thumbnails = Thumbnails()
+        self.covers = CoverCache(self, thumbnails=self.thumbnails)
+        self.cover_store = CoverStore()
         self.init_screen()
 
     def progress_database(self):
@@ -39,26 +51,40 @@ class BookApp(Tk):
         pic.img = load_pic
         pic.place(relx=0.5, rely=0.5, anchor="center")
 
-        self.task_thread = Thread(target=self.load_database)
         self.bar.start()
-        self.task_thread.start()
-        self.after(100, self.check_load_database)
-
-    def check_load_database(self):
-        """ Use to check stutus of loading task """
-        if self.task_thread.is_alive():
-            self.after(100, self.check_load_database)
-        else:
-            self.bar.stop()
-            self.bar.place_forget()
-            self.manage_all_page()
+        self.executor.submit(self.load_database,
+                             on_done=lambda result: self.finish_load_database(),
+                             on_error=self.load_database_failed)
+
+    def finish_load_database(self):
+        """ Use to show all page once database is loaded """
+        self.mark("database loaded")
+        self.bar.stop()
+        self.bar.place_forget()
+        self.manage_all_page()
+
+    def load_database_failed(self, error):
+        messagebox.showerror("Connection error",
+                             "Unable to find the server."
+                             "Please connect the internet "
+                             "to use the application")
+        self.destroy()
 
     def load_database(self):
         """ Load database on Google sheet """
         service_file = 'keys.json'
         spreadsheet = 'Book collection demo'
         worksheet = 'Sheet1'
-        self.database = BookDatabase(service_file, spreadsheet, worksheet)
+        # BOOK_STORAGE=sqlite keeps the collection in a local file instead
+        storage = os.environ.get("BOOK_STORAGE", "sheets")
+        # BOOK_OFFLINE=1 writes locally first and syncs in the background
+        offline = os.environ.get("BOOK_OFFLINE") == "1"
+        # BOOK_DELTA=1 refreshes only the rows other people changed
+        delta_sync = os.environ.get("BOOK_DELTA") == "1"
+        from book_database import BookDatabase
+        self.database = BookDatabase(service_file, spreadsheet, worksheet,
+                                     storage=storage, offline=offline,
+                                     delta_sync=delta_sync)
 
     def init_screen(self):
         """ Init screen size, position """
@@ -68,27 +94,73 @@ class BookApp(Tk):
         self.resizable(False, False)
 
     def manage_all_page(self):
-        """ Use to manage all page in this app """
-        container = Frame(self)
-        container.pack(side="top", fill="both", expand=True)
-        container.grid_rowconfigure(0, weight=1)
-        container.grid_columnconfigure(0, weight=1)
+        """ Use to manage all page in this app, each page is built the
+        first time it's shown and the rest are pre-warmed when idle """
+        self.container = Frame(self)
+        self.container.pack(side="top", fill="both", expand=True)
+        self.container.grid_rowconfigure(0, weight=1)
+        self.container.grid_columnconfigure(0, weight=1)
         all_page = (HomePage, ChangeSheetPage,
                     MenuPage, AddBookPage,
                     FindBookPage, EditBookPage,
                     ShowBooksPage, FilterBookPage,
                     BookStatisticPage, AboutAppPage)
-        for page in all_page:
-            frame = page(container, self)
-            self.frames[page] = frame
-            frame.grid(row=0, column=0, sticky="nsew")
         self.show_frame(HomePage)
+        self.mark("home page shown")
+        self.after_idle(self.first_idle)
+        # BOOK_PREWARM=0 only builds pages when they are opened
+        if os.environ.get("BOOK_PREWARM") != "0":
+            self.after(200, self.prewarm_pages, list(all_page))
+
+    def page_frame(self, page):
+        """ Return the page, building it the first time it's needed """
+        if page not in self.frames:
+            start = time.perf_counter()
+            frame = page(self.container, self)
+            frame.grid(row=0, column=0, sticky="nsew")
+            # a new frame stacks above the page on screen until raised
+            frame.lower()
+            self.frames[page] = frame
+            self.timings.append((f"built {page.__name__}",
+                                 time.perf_counter() - start))
+        return self.frames[page]
 
     def show_frame(self, page):
         """ Use to raise selected frame to screen """
-        frame = self.frames[page]
+        frame = self.page_frame(page)
         frame.tkraise()
 
+    def prewarm_pages(self, pages):
+        """ Build one page per idle turn of the event loop so clicks in
+        between are still handled """
+        pages = [page for page in pages if page not in self.frames]
+        if not pages:
+            self.mark("all pages built")
+            self.startup_report()
+            return
+        self.page_frame(pages[0])
+        self.after(20, self.prewarm_pages, pages[1:])
+
+    def first_idle(self):
+        self.update_idletasks()
+        self.mark("first interactive window")
+        if os.environ.get("BOOK_PREWARM") == "0":
+            self.startup_report()
+
+    def mark(self, step):
+        self.timings.append((step, time.perf_counter() - STARTED_AT))
+
+    def startup_report(self):
+        """ Print where startup time went when BOOK_TIMING=1 """
+        if os.environ.get("BOOK_TIMING") != "1":
+            return
+        print("Startup timings")
+        for step, seconds in self.timings:
+            if step.startswith("built "):
+                print(f"  {step:<30} took {seconds * 1000:8.1f} ms")
+            else:
+                print(f"  {step:<30} at   {seconds * 1000:8.1f} ms")
+
     def run(self):
         self.progress_database()
         self.mainloop()
@@ -99,6 +171,14 @@ class Page(Frame):
         Frame.__init__(self, parent)
         self.controller = controller
         self.database = controller.database
+        # progress bar is made on first task so it stays above the background
+        self.bar = None
+        # one label per page, show_cover() swaps its image
+        self.cover_lb = None
+        self.running_tasks = 0
+        self.keyed_tasks = {}
+        # refreshes waiting for Tk to go idle, see coalesce()
+        self.pending_refreshes = {}
         self.init_background()
         self.init_command_bar()
 
@@ -108,6 +188,15 @@ class Page(Frame):
         bg.img = bg_img
         bg.place(relx=0.5, rely=0.5, anchor='center')
 
+    def show_cover(self, cover, **place):
+        size = {"width": 533, "height": 356}
+        cover_pic = self.controller.covers.get(self.controller.cover_store.path(cover))
+        if self.cover_lb is None:
+            self.cover_lb = Label(self, **size)
+            self.cover_lb.place(anchor='center', **place, **size)
+        self.cover_lb.config(image=cover_pic)
+        self.cover_lb.img = cover_pic
+
     def init_command_bar(self):
 
         home_btn = Button(self, text="🏠 Home",
@@ -136,31 +225,73 @@ class Page(Frame):
         reload_btn.place(relx=0.86, rely=1, anchor='s',
                          width=145, height=39)
 
-    def progress_task(self, task):
+    def progress_task(self, task, on_done=None, on_error=None, key=None):
+        """ Run task on the shared executor and show progress until it's done.
+        on_done/on_error run on the main thread, a task with the same key
+        that is still waiting gets cancelled. """
+        if key in self.keyed_tasks:
+            self.keyed_tasks.pop(key).cancel()
+        self.start_progress()
+
+        def done(result):
+            self.stop_progress()
+            if on_done is not None:
+                on_done(result)
+
+        def failed(error):
+            self.stop_progress()
+            if on_error is not None:
+                on_error(error)
+            elif not isinstance(error, CancelledError):
+                messagebox.showerror("Something went wrong", str(error))
+
+        future = self.controller.executor.submit(task, on_done=done,
+                                                 on_error=failed)
+        if key is not None:
+            self.keyed_tasks[key] = future
+        return future
+
+    def coalesce(self, key, refresh):
+        """ Run refresh once when Tk is next idle, however many variable
+        writes ask for it before then, so setting several variables (or
+        ticking ten checkboxes) redraws once with the final state """
+        if key not in self.pending_refreshes:
+            self.pending_refreshes[key] = self.after_idle(self.run_refresh,
+                                                          key, refresh)
+
+    def run_refresh(self, key, refresh):
+        del self.pending_refreshes[key]
+        refresh()
+
+    def trace_refresh(self, variable, key, refresh):
+        variable.trace("w", lambda *args: self.coalesce(key, refresh))
+
+    def start_progress(self):
         """ Use to show on screen when loading database"""
-        self.bar = Progressbar(self, length=200, mode="indeterminate")
-        self.bar.place(relx=0.175, rely=0.99, anchor="s")
-        self.loading_text = ["Loading", "Loading.", "Loading..", "Loading..."]
+        self.running_tasks += 1
+        if self.running_tasks > 1:
+            return
+        if self.bar is None:
+            self.bar = Progressbar(self, length=200, mode="indeterminate")
+            self.loading_text = ["Loading", "Loading.", "Loading..", "Loading..."]
+            self.loading = Label(self, text=self.loading_text[0],
+                                 **self.label_style('normal', 14))
         self.progress_num = 0
-        self.loading = Label(self, text=self.loading_text[self.progress_num],
-                             **self.label_style('normal', 14)
-                             )
+        self.bar.place(relx=0.175, rely=0.99, anchor="s")
         self.loading.place(relx=0.262, rely=0.957)
-        self.task_thread = Thread(target=task)
         self.bar.start()
-        self.task_thread.start()
-        self.after(200, self.check_load_task)
-
-    def check_load_task(self):
-        """ Use to check stutus of loading task """
-        if self.task_thread.is_alive():
-            self.progress_num += 1
-            if self.progress_num == 4:
-                self.progress_num = 0
-            self.loading.config(text=self.loading_text[self.progress_num],
-                                **self.label_style('normal', 14))
-            self.after(200, self.check_load_task)
-        else:
+        self.after(200, self.animate_progress)
+
+    def animate_progress(self):
+        if not self.running_tasks:
+            return
+        self.progress_num = (self.progress_num + 1) % len(self.loading_text)
+        self.loading.config(text=self.loading_text[self.progress_num])
+        self.after(200, self.animate_progress)
+
+    def stop_progress(self):
+        self.running_tasks -= 1
+        if not self.running_tasks:
             self.bar.stop()
             self.bar.place_forget()
             self.loading.place_forget()
@@ -326,12 +457,11 @@ class ChangeSheetPage(Page):
         self.work_name = StringVar()
         self.spread_en = Entry(self)
         self.work_en = Entry(self)
-        self.spread_text.set(self.database.spreadsheet_name)
-        self.work_text.set(self.database.worksheet_name)
+        self.show_sheet_name()
         self.init_components()
         self.init_reset_btn("Reload data",
                             lambda: self.progress_task
-                            (self.database.update_df))
+                            (lambda: self.database.update_df(force=True)))
 
     def init_components(self):
         menu_btn = Button(self, text="☰ Menu",
@@ -350,12 +480,10 @@ class ChangeSheetPage(Page):
         quit_btn.place(relx=0.783, rely=0, **place_option)
 
         spreadsheet_btn = Button(self, text="Change spreadsheet",
-                                 command=lambda: self.progress_task
-                                 (self.change_spreadsheet),
+                                 command=self.change_spreadsheet,
                                  **self.button_style('normal'))
         worksheet_btn = Button(self, text="Change worksheet",
-                               command=lambda: self.progress_task
-                               (self.change_worksheet),
+                               command=self.change_worksheet,
                                **self.button_style('special'))
         self.spread_en.config(textvariable=self.spread_name, **self.entry_style())
         self.work_en.config(textvariable=self.work_name, **self.entry_style())
@@ -375,22 +503,29 @@ class ChangeSheetPage(Page):
         work_label.place(relx=0.26, rely=0.85, anchor='center')
 
     def change_spreadsheet(self):
-        try:
-            spreadsheet = self.spread_en.get()
-            self.database.update_sheet(spreadsheet=spreadsheet)
-            self.spread_text.set(spreadsheet)
-            self.spread_name.set("")
-        except Exception:
-            self.spread_name.set("")
+        spreadsheet = self.spread_en.get()
+        self.progress_task(lambda: self.database.update_sheet(spreadsheet=spreadsheet),
+                           on_done=lambda result: self.show_sheet_name(),
+                           on_error=self.sheet_not_opened)
+        self.spread_name.set("")
 
     def change_worksheet(self):
-        try:
-            worksheet = self.work_en.get()
-            self.database.update_sheet(worksheet=worksheet)
-            self.work_text.set(worksheet)
-            self.work_name.set("")
-        except Exception:
-            self.work_name.set("")
+        worksheet = self.work_en.get()
+        self.progress_task(lambda: self.database.update_sheet(worksheet=worksheet),
+                           on_done=lambda result: self.show_sheet_name(),
+                           on_error=self.sheet_not_opened)
+        self.work_name.set("")
+
+    @staticmethod
+    def sheet_not_opened(error):
+        # the database stays on the sheet it had
+        if not isinstance(error, CancelledError):
+            messagebox.showerror("Unable to open the sheet",
+                                 str(error) or type(error).__name__)
+
+    def show_sheet_name(self):
+        self.spread_text.set(self.database.spreadsheet_name)
+        self.work_text.set(self.database.worksheet_name)
 
 
 class MenuPage(Page):
@@ -461,13 +596,13 @@ class AddBookPage(Page):
         self.status = Entry(self)
         self.location = Entry(self)
         self.init_components()
-        self.default_pic = r"picApp/cover/default_cover.png"
+        self.default_pic = DEFAULT_COVER
         self.change_pic(self.default_pic)
         self.init_reset_btn('Reset', self.clear)
 
     def init_components(self):
         confirm_btn = Button(self, text="Confirm",
-                             command=lambda: self.progress_task(self.confirm_add_book),
+                             command=self.confirm_add_book,
                              **self.button_style('normal'))
         place_op = {"rely": 0.86, "anchor": 'center', "width": 250, "height": 53}
         confirm_btn.place(relx=0.291, **place_op)
@@ -528,37 +663,29 @@ class AddBookPage(Page):
         rating = self.rating.get()
         status = self.status.get()
         location = self.location.get()
-        try:
-            cover = cover[cover.index('picApp'):]
-        except Exception:
-            cover = "picApp/cover/default_cover.png"
-        Book(self.database, nameTH, nameEN, author, publisher,
-             isbn, category, rating, status, location, cover)
+        cover_store = self.controller.cover_store
+        from book import Book
+        # the chosen image is copied into the store, the sheet gets its hash
+        self.progress_task(lambda: Book(self.database, nameTH, nameEN, author,
+                                        publisher, isbn, category, rating,
+                                        status, location,
+                                        cover_store.cover_value(cover)))
         self.clear()
         self.change_pic(self.default_pic)
 
     def browse_pic(self):
+        # any image works, the cover store turns it into a PNG on confirm
         filename = askopenfilename(
-            filetypes=(("png file", '*.png'), ("All files", "*.*")))
+            filetypes=(("Image file", '*.png *.jpg *.jpeg *.gif *.bmp *.webp'),
+                       ("All files", "*.*")))
+        if not filename:
+            return
         self.cover.delete(0, END)
         self.cover.insert(END, filename)
-        if filename[-3:] == 'png':
-            self.change_pic(filename)
-        else:
-            self.change_pic(self.default_pic)
-            self.cover.delete(0, END)
+        self.change_pic(filename)
 
-    def change_pic(self, cover=r"picApp/cover/default_cover.png"):
-        size = {"width": 533, "height": 356}
-        if not cover:
-            cover = r"picApp/cover/default_cover.png"
-        try:
-            cover_pic = PhotoImage(file=cover)
-        except EXCEPTION:
-            cover_pic = PhotoImage(file=r"picApp/cover/default_cover.png")
-        cover_lb = Label(self, image=cover_pic, **size)
-        cover_lb.img = cover_pic
-        cover_lb.place(relx=0.291, rely=0.515, anchor='center', **size)
+    def change_pic(self, cover=DEFAULT_COVER):
+        self.show_cover(cover, relx=0.291, rely=0.515)
 
 
 class FindBookPage(Page):
@@ -579,17 +706,18 @@ class FindBookPage(Page):
         self.status = StringVar()
         self.location = StringVar()
         self.cover = StringVar()
-        self.change_pic(r"picApp/cover/default_cover.png")
+        self.change_pic(DEFAULT_COVER)
 
         # for get a book
         self.findby_box = Combobox(self)
         self.detail_box = Combobox(self)
         self.findby = StringVar()
         self.detail = StringVar()
+        self.search_limit = 50
         self.findby.set(self.database.findable_list[0])
         self.load_findable_book(self.findby.get())
         self.init_components()
-        self.init_reset_btn('Reset', lambda: self.progress_task(self.reset))
+        self.init_reset_btn('Reset', self.reset)
 
     def init_components(self):
         self.findby_box.config(textvariable=self.findby,
@@ -597,9 +725,13 @@ class FindBookPage(Page):
                                **self.combobox_style())
         self.detail_box.config(textvariable=self.detail,
                                **self.combobox_style())
-        self.findby.trace("w", lambda *args: self.load_findable_book(self.findby.get()))
-        self.detail.trace("w", lambda *args: self.load_book(self.findby.get(),
-                                                            self.detail.get()))
+        # user can type in detail box, the list shows best matches so far
+        self.detail_box.config(state='normal')
+        self.detail_box.bind("<KeyRelease>", lambda event: self.search_book())
+        self.trace_refresh(self.findby, "findby",
+                           lambda: self.load_findable_book(self.findby.get()))
+        self.trace_refresh(self.detail, "book",
+                           lambda: self.load_book(self.findby.get(), self.detail.get()))
 
         place_op = {"anchor": 'center', "height": 40, "rely": 0.285}
         self.findby_box.place(relx=0.35, width=200, **place_op)
@@ -634,12 +766,14 @@ class FindBookPage(Page):
         if self.detail.get():
             self.detail.set("")
             self.clear_book()
-        all_book = self.database.all_findable_book(findby)
-        self.detail_box.config(values=all_book)
+        self.search_book()
+
+    def search_book(self):
+        matches = self.database.search(self.findby.get(), self.detail.get(),
+                                       self.search_limit)
+        self.detail_box.config(values=matches)
 
     def load_book(self, findable, detail):
-        if detail and findable == "BookID":
-            detail = int(detail)
         book = self.database.find_book(findable, detail)
         try:
             self.bookid.set(book["BookID"])
@@ -676,24 +810,15 @@ class FindBookPage(Page):
         self.findby.set(self.database.findable_list[0])
         self.clear_book()
 
-    def change_pic(self, cover=r"picApp/cover/default_cover.png"):
-        size = {"width": 533, "height": 356}
-        if not cover:
-            cover = r"picApp/cover/default_cover.png"
-        try:
-            cover_pic = PhotoImage(file=cover)
-        except EXCEPTION:
-            cover_pic = PhotoImage(file=r"picApp/cover/default_cover.png")
-        cover_lb = Label(self, image=cover_pic, **size)
-        cover_lb.img = cover_pic
-        cover_lb.place(relx=0.31, rely=0.629, anchor='center', **size)
+    def change_pic(self, cover=DEFAULT_COVER):
+        self.show_cover(cover, relx=0.31, rely=0.629)
 
 
 class EditBookPage(Page):
     def __init__(self, parent, controller):
         super().__init__(parent, controller)
         self.init_background(r"picApp/edit_book_bg.png")
-        self.default_pic = r"picApp/cover/default_cover.png"
+        self.default_pic = DEFAULT_COVER
         self.init_command_bar()
         self.bookid_box = Combobox(self)
         self.bookid = IntVar()
@@ -709,20 +834,26 @@ class EditBookPage(Page):
         self.location = Entry(self)
         self.init_components()
         self.change_pic(self.default_pic)
-        self.init_reset_btn('Reset', lambda: self.progress_task(self.reset))
+        self.init_reset_btn('Reset', self.reset)
 
     def init_components(self):
         edit_btn = Button(self, text="Confirm edit",
-                          command=lambda: self.progress_task(self.confirm_edit_book),
+                          command=self.confirm_edit_book,
                           **self.button_style('normal'))
 
         edit_btn.place(relx=0.294, rely=0.882, anchor='center',
                        width=230, height=45)
+        delete_btn = Button(self, text="Delete book",
+                            command=self.confirm_delete_book,
+                            **self.button_style('quit'))
+        delete_btn.place(relx=0.294, rely=0.96, anchor='center',
+                         width=230, height=35)
 
         self.bookid_box.config(textvariable=self.bookid,
                                values=self.database.all_findable_book("BookID"),
                                **self.combobox_style())
-        self.bookid.trace("w", lambda *args: self.load_book("BookID", self.bookid.get()))
+        self.trace_refresh(self.bookid, "book",
+                           lambda: self.load_book("BookID", self.bookid.get()))
 
         self.bookid_box.place(relx=0.32, rely=0.272, anchor='center',
                               width=100, height=35)
@@ -808,48 +939,232 @@ class EditBookPage(Page):
             except ValueError:
                 rating = 0
 
-            try:
-                cover = cover[cover.index('picApp'):]
-            except:
-                cover = "picApp/cover/default_cover.png"
-            self.database.edit_book(self.bookid.get(),
-                                    [self.bookid.get(), nameTH,
-                                     nameEN, author, publisher,
-                                     isbn, category, rating,
-                                     status, location, cover])
+            cover_store = self.controller.cover_store
+            bookid = self.bookid.get()
+            self.progress_task(lambda: self.database.edit_book(
+                bookid, [bookid, nameTH, nameEN, author, publisher,
+                         isbn, category, rating, status, location,
+                         cover_store.cover_value(cover)]))
             self.clear()
             self.reset()
             self.change_pic(self.default_pic)
 
+    def confirm_delete_book(self):
+        if not self.bookid.get():
+            messagebox.showwarning(title="Input error",
+                                   message="Please selected bookID to delete")
+            return
+        bookid = self.bookid.get()
+        if not messagebox.askyesno(title="Delete book",
+                                   message=f"Delete book {bookid}?"):
+            return
+        self.progress_task(lambda: self.database.delete_book(bookid),
+                           on_done=lambda result: self.reload_bookid())
+        self.clear()
+        self.change_pic(self.default_pic)
+
     def browse_pic(self):
+        # any image works, the cover store turns it into a PNG on confirm
         filename = askopenfilename(
-            filetypes=(("png file", '*.png'), ("All files", "*.*")))
+            filetypes=(("Image file", '*.png *.jpg *.jpeg *.gif *.bmp *.webp'),
+                       ("All files", "*.*")))
+        if not filename:
+            return
         self.cover.delete(0, END)
         self.cover.insert(END, filename)
-        if filename[-3:] == 'png':
-            self.change_pic(filename)
-        else:
-            self.change_pic(self.default_pic)
-            self.cover.delete(0, END)
+        self.change_pic(filename)
 
-    def change_pic(self, cover=r"picApp/cover/default_cover.png"):
-        size = {"width": 533, "height": 356}
-        if not cover:
-            cover = r"picApp/cover/default_cover.png"
-        try:
-            cover_pic = PhotoImage(file=cover)
-        except:
-            cover_pic = PhotoImage(file=r"picApp/cover/default_cover.png")
-        cover_lb = Label(self, image=cover_pic, **size)
-        cover_lb.img = cover_pic
-        cover_lb.place(relx=0.291, rely=0.576, anchor='center', **size)
+    def change_pic(self, cover=DEFAULT_COVER):
+        self.show_cover(cover, relx=0.291, rely=0.576)
 
     def reset(self):
-        self.database.update_df()
+        self.progress_task(self.database.update_df,
+                           on_done=lambda result: self.reload_bookid(),
+                           key="reset")
+
+    def reload_bookid(self):
         self.bookid_box.config(values=self.database.all_findable_book("BookID"))
         self.bookid.set(0)
 
 
+class TableView:
+    """ One pandastable Table per page with its data swapped in place.
+
+    pandastable only draws the rows and columns in view, so keeping one
+    Table and giving its model a new frame is all a filter, toggle or
+    sort needs, instead of a new widget (and the old one left behind)
+    every time. The table shows a projection of the frame, the chosen
+    columns of it without copying their data, and rows stay in the
+    frame's sorted order when columns are shown or hidden.
+    """
+
+    def __init__(self, parent, sort_column=None, ascending=True, **options):
+        from pandastable import Table
+        self.table = Table(parent, **options)
+        self.table.show()
+        self.sort_column = sort_column
+        self.ascending = ascending
+        self.frame = None
+        self.columns = None     # None shows every column
+
+    def show(self, df, columns=None):
+        """ Show new rows, only the given columns of them if any """
+        self.frame = self.sorted(df)
+        if columns is not None:
+            self.columns = list(columns)
+        # the old selection may be past the end of the new frame
+        self.table.clearSelected()
+        self.table.currentrow = self.table.currentcol = 0
+        self.table.multiplerowlist = []
+        self.table.multiplecollist = []
+        self.table.set_yviews("moveto", 0)
+        self.project()
+
+    def show_columns(self, columns):
+        """ Show other columns of the same rows, in the order they're in """
+        model_df = self.table.model.df
+        if not model_df.index.equals(self.frame.index):
+            # sorted from the column header since, keep that order
+            self.frame = self.frame.reindex(model_df.index)
+        self.columns = list(columns)
+        self.table.multiplecollist = []
+        self.table.currentcol = 0
+        self.project()
+
+    def project(self):
+        old_columns = self.table.model.df.columns.tolist()
+        if self.columns is None:
+            columns = self.frame.columns.tolist()
+        else:
+            columns = [column for column in self.columns
+                       if column in self.frame.columns]
+        # with copy-on-write this shares the frame's data, and a sort from
+        # the column header only reorders the projection, not the frame
+        self.table.model.df = self.frame[columns]
+        if columns != old_columns:
+            self.table.adjustColumnWidths()
+        self.table.redraw()
+
+    def sort(self, column, ascending=True):
+        if (column, ascending) == (self.sort_column, self.ascending) and \
+                self.table.model.df.index.equals(self.frame.index):
+            return
+        self.sort_column = column
+        self.ascending = ascending
+        self.frame = self.sorted(self.frame)
+        self.project()
+
+    def sorted(self, df):
+        if self.sort_column not in df.columns:
+            return df
+        try:
+            # categories are in the order they were added, sort by value
+            return df.sort_values(self.sort_column, ascending=self.ascending,
+                                  kind="stable",
+                                  key=lambda column: column.astype(object))
+        except TypeError:
+            # text and numbers mixed in one column, leave it as it is
+            return df
+
+
+class ChartView:
+    """ Bar and pie charts drawn on one figure with their artists kept.
+
+    Both charts have their own axes, shown one at a time, and the bars,
+    wedges and labels are made once and then moved, resized, hidden or
+    relabelled in place, so switching charts never clears the figure
+    or replots through pandas. Drawing is left to draw_idle.
+    """
+
+    def __init__(self, master):
+        import matplotlib
+        matplotlib.use('TkAgg')
+        import seaborn as sns
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+        # the theme only has to be set once, before the axes are made
+        sns.set_theme(style="darkgrid", palette="BrBG_r")
+        self.colors = matplotlib.rcParams["axes.prop_cycle"].by_key()["color"]
+        self.fig = Figure()
+        # room for the slanted group names under the bars
+        self.fig.subplots_adjust(bottom=0.2)
+        self.bar_axes = self.fig.add_subplot()
+        self.pie_axes = self.fig.add_subplot(label="pie")
+        self.pie_axes.set_aspect("equal")
+        self.pie_axes.axis("off")
+        self.pie_axes.set_xlim(-1.3, 1.3)
+        self.pie_axes.set_ylim(-1.3, 1.3)
+        self.pie_axes.set_visible(False)
+        self.bars = []
+        self.legend = None
+        self.wedges = []
+        self.labels = []
+        self.percents = []
+        self.canvas = FigureCanvasTkAgg(self.fig, master=master)
+
+    def widget(self):
+        return self.canvas.get_tk_widget()
+
+    def show_bars(self, series, title, ylim, label):
+        from matplotlib.patches import Rectangle
+        axes = self.bar_axes
+        self.pie_axes.set_visible(False)
+        axes.set_visible(True)
+        while len(self.bars) < len(series):
+            self.bars.append(axes.add_patch(
+                Rectangle((0, 0), 0.5, 0, facecolor=self.colors[0])))
+        for position, bar in enumerate(self.bars):
+            if position < len(series):
+                bar.set_xy((position - 0.25, 0))
+                bar.set_height(series.iloc[position])
+            bar.set_visible(position < len(series))
+        if self.legend is None and self.bars:
+            self.legend = axes.legend([self.bars[0]], [label])
+        axes.set_xticks(range(len(series)))
+        axes.set_xticklabels([str(key) for key in series.index],
+                             rotation=30, ha="center")
+        axes.set_xlim(-0.5, max(len(series), 1) - 0.5)
+        axes.set_ylim(*ylim)
+        axes.set_xlabel(series.index.name or "")
+        axes.set_title(title)
+        self.canvas.draw_idle()
+
+    def show_pie(self, series, title, autopct):
+        import math
+        from matplotlib.patches import Wedge
+        axes = self.pie_axes
+        self.bar_axes.set_visible(False)
+        axes.set_visible(True)
+        while len(self.wedges) < len(series):
+            self.wedges.append(axes.add_patch(Wedge((0, 0), 1, 0, 0)))
+            self.labels.append(axes.text(0, 0, "", va="center"))
+            self.percents.append(axes.text(0, 0, "", ha="center", va="center"))
+        total = series.sum()
+        angle = 0
+        for position, wedge in enumerate(self.wedges):
+            shown = position < len(series) and total > 0
+            for artist in (wedge, self.labels[position], self.percents[position]):
+                artist.set_visible(shown)
+            if not shown:
+                continue
+            value = series.iloc[position]
+            sweep = 360 * value / total
+            wedge.set_theta1(angle)
+            wedge.set_theta2(angle + sweep)
+            wedge.set_facecolor(self.colors[position % len(self.colors)])
+            middle = math.radians(angle + sweep / 2)
+            x, y = math.cos(middle), math.sin(middle)
+            label = self.labels[position]
+            label.set_position((1.1 * x, 1.1 * y))
+            label.set_text(str(series.index[position]))
+            label.set_horizontalalignment("left" if x >= 0 else "right")
+            self.percents[position].set_position((0.6 * x, 0.6 * y))
+            self.percents[position].set_text(autopct(100 * value / total))
+            angle += sweep
+        axes.set_title(title)
+        self.canvas.draw_idle()
+
+
 class ShowBooksPage(Page):
     def __init__(self, parent, controller):
         super().__init__(parent, controller)
@@ -885,9 +1200,6 @@ class ShowBooksPage(Page):
         self.atoz = Radiobutton(self)
         self.ztoa = Radiobutton(self)
 
-        self.table_frame = Frame(self)
-        self.table = Table(self.table_frame)
-
         self.all_check_box = [(self.check_nameTH, self.nameTH_status),
                               (self.check_nameEN, self.nameEN_status),
                               (self.check_author, self.author_status),
@@ -902,7 +1214,7 @@ class ShowBooksPage(Page):
         self.sort_to.set("a")
         self.init_components()
         self.init_table()
-        self.init_reset_btn("Reset", lambda: self.progress_task(self.reset))
+        self.init_reset_btn("Reset", self.reset)
         self.trace_checkbox()
 
     def init_components(self):
@@ -980,35 +1292,34 @@ class ShowBooksPage(Page):
 
         self.atoz.config(text="A to Z", value="a",
                          variable=self.sort_to,
-                         command=self.update_sort_to,
                          **self.radio_style())
         self.ztoa.config(text="Z to A", value="z",
                          variable=self.sort_to,
-                         command=self.update_sort_to,
                          **self.radio_style())
 
         place_op2 = {"rely": 0.85, "anchor": "e", "width": 150, "height": 30}
         self.atoz.place(relx=0.76, **place_op2)
         self.ztoa.place(relx=0.89, **place_op2)
-        self.sort_to.trace("w", lambda *args: self.update_sort_to())
-        self.sort_by.trace("w", lambda *args: self.update_table())
+        self.trace_refresh(self.sort_to, "sort", self.update_sort_to)
+        self.trace_refresh(self.sort_by, "sort", self.update_sort_to)
 
     def update_sort_to(self):
-        try:
-            col = self.sort_by.get()
-            index = self.selected_cols.index(col)
-            if self.sort_to.get() == "a":
-                self.table.sortTable(columnIndex=index, ascending=1)
-            if self.sort_to.get() == "z":
-                self.table.sortTable(columnIndex=index, ascending=0)
-        except ValueError:
+        col = self.sort_by.get()
+        if col not in self.selected_cols:
             self.reset()
+            return
+        self.table.sort(col, ascending=self.sort_to.get() != "z")
 
     def reset(self):
+        self.progress_task(self.database.update_df,
+                           on_done=lambda result: self.reset_table(),
+                           key="reset")
+
+    def reset_table(self):
         self.sort_to.set("a")
         self.sort_by.set("BookID")
-        self.database.update_df()
         self.check_all_box()
+        self.show_table(self.database.bookdf)
 
     def check_all_box(self):
         for check in self.all_check_box:
@@ -1018,54 +1329,33 @@ class ShowBooksPage(Page):
                 box.select()
 
     def trace_checkbox(self):
-        self.nameTH_status.trace("w",
-                                 lambda *args: self.update_df_table(self.nameTH_status))
-        self.nameEN_status.trace("w",
-                                 lambda *args: self.update_df_table(self.nameEN_status))
-        self.author_status.trace("w",
-                                 lambda *args: self.update_df_table(self.author_status))
-        self.publisher_status.trace("w", lambda *args: self.update_df_table(
-            self.publisher_status))
-        self.isbn_status.trace("w", lambda *args: self.update_df_table(self.isbn_status))
-        self.category_status.trace("w", lambda *args: self.update_df_table(
-            self.category_status))
-        self.rating_status.trace("w",
-                                 lambda *args: self.update_df_table(self.rating_status))
-        self.status_status.trace("w",
-                                 lambda *args: self.update_df_table(self.status_status))
-        self.location_status.trace("w", lambda *args: self.update_df_table(
-            self.location_status))
-        self.cover_status.trace("w",
-                                lambda *args: self.update_df_table(self.cover_status))
+        for box, status in self.all_check_box:
+            self.trace_refresh(status, "columns", self.update_columns)
 
     def init_table(self):
         self.table_frame = Frame(self, width=643, height=463)
         self.table_frame.place(relx=0.339, rely=0.575, anchor="center")
-        self.show_table(self.database.selected_column(self.all_col))
+        self.table = TableView(self.table_frame, width=570, height=390,
+                               showstatusbar=True)
+        self.show_table(self.database.bookdf)
 
     def show_table(self, df):
-        self.table = Table(self.table_frame, dataframe=df,
-                           width=570, height=390,
-                           showstatusbar=True)
-        self.table.show()
-
-    def update_df_table(self, value):
-        val = value.get()
-        if '-' not in val:
-            self.selected_cols.append(val)
-        else:
-            if f"{self.sort_by.get()}" == val[1:]:
-                self.sort_by.set("BookID")
-                self.sort_to.set("a")
-            self.selected_cols.remove(val[1:])
-        self.selected_cols.sort(key=lambda x: self.all_col.index(x))
+        self.table.show(df, self.selected_cols)
+
+    def update_columns(self):
+        # a box holds its column's name when ticked, "-" and the name when not
+        hidden = {status.get()[1:] for box, status in self.all_check_box
+                  if status.get().startswith("-")}
+        self.selected_cols = [col for col in self.all_col if col not in hidden]
+        if self.sort_by.get() not in self.selected_cols:
+            self.sort_by.set("BookID")
+            self.sort_to.set("a")
         self.update_table()
 
     def update_table(self):
-        df = self.database.selected_column(self.selected_cols)
+        # hiding or showing a column keeps the rows as they are sorted
         self.sortby_box.config(values=self.selected_cols)
-        self.show_table(df)
-        self.update_sort_to()
+        self.table.show_columns(self.selected_cols)
 
 
 class FilterBookPage(Page):
@@ -1077,13 +1367,16 @@ class FilterBookPage(Page):
         self.detail_box = Combobox(self)
         self.filterby = StringVar()
         self.detail = StringVar()
-        self.table_frame = Frame(self)
-        self.table = Table(self.table_frame)
         self.detail.set("")
         self.filterby.set("")
+        # what the table shows, None for every book
+        self.predicate = None
+        # "" is both no choice yet and the option for empty cells
+        self.detail_chosen = False
         self.init_components()
         self.init_table()
-        self.init_reset_btn("Reset", lambda: self.progress_task(self.reset))
+        self.init_bulk_edit()
+        self.init_reset_btn("Reset", self.reset)
 
     def init_components(self):
         self.filterby_box.config(textvariable=self.filterby,
@@ -1091,41 +1384,102 @@ class FilterBookPage(Page):
                                  **self.combobox_style())
         self.detail_box.config(textvariable=self.detail,
                                **self.combobox_style())
-        self.filterby.trace("w",
-                            lambda *args: self.load_filterable_book(self.filterby.get()))
-        self.detail.trace("w", lambda *args: self.load_table(self.filterby.get(),
-                                                             self.detail.get()))
+        self.trace_refresh(self.filterby, "filterby",
+                           lambda: self.load_filterable_book(self.filterby.get()))
+        self.trace_refresh(self.detail, "table", self.refresh_table)
+        self.detail_box.bind("<<ComboboxSelected>>", self.choose_detail)
 
         place_op = {"anchor": 'center', "height": 40, "rely": 0.285}
         self.filterby_box.place(relx=0.41, width=200, **place_op)
         self.detail_box.place(relx=0.61, width=280, **place_op)
 
+    def refresh_table(self):
+        self.load_table(self.filterby.get(), self.detail.get())
+
+    def choose_detail(self, event=None):
+        self.detail_chosen = True
+        # picking the empty option again doesn't always write the variable
+        self.coalesce("table", self.refresh_table)
+
     def load_filterable_book(self, filterby):
-        if self.detail.get():
+        if self.detail.get() or self.detail_chosen:
+            # shows every book again once the table refresh runs
+            self.detail_chosen = False
             self.detail.set("")
-            self.show_table(self.database.bookdf)
         all_detail = self.database.all_filterable_book(filterby)
 
-        self.detail_box.config(values=sorted(all_detail))
+        # ratings mix numbers with empty cells
+        self.detail_box.config(values=sorted(all_detail, key=str))
 
     def init_table(self):
         self.table_frame = Frame(self, width=1040, height=390)
         self.table_frame.place(relx=0.5, rely=0.618, anchor="center")
+        self.table = TableView(self.table_frame, sort_column="BookID",
+                               width=970, height=320, showstatusbar=True)
         self.show_table(self.database.bookdf)
 
     def show_table(self, df):
-        self.table = Table(self.table_frame, dataframe=df,
-                           width=970, height=320,
-                           showstatusbar=True)
-        self.table.show()
-        self.table.sortTable(columnIndex=0, ascending=1)
+        self.table.show(df)
 
     def load_table(self, filterable, detail):
-        if detail and filterable == "Rating":
+        if not self.detail_chosen:
+            self.predicate = None
+            self.show_table(self.database.bookdf)
+            return
+        if filterable == "Rating" and detail != "":
             detail = float(detail)
+        from book_database import Eq
+        self.predicate = Eq(filterable, detail)
         df = self.database.filter_books(filterable, detail)
         self.show_table(df)
 
+    def init_bulk_edit(self):
+        """ Set one column of every book in the table at once """
+        self.bulk_column = StringVar()
+        self.bulk_column_box = Combobox(self, textvariable=self.bulk_column,
+                                        values=self.database.filterable_list[:-1],
+                                        **self.combobox_style())
+        self.bulk_value = Entry(self, **self.entry_style())
+        apply_btn = Button(self, text="Apply to all shown",
+                           command=self.confirm_bulk_edit,
+                           **self.button_style('normal'))
+        place_op = {"anchor": 's', "height": 39, "rely": 1}
+        self.bulk_column_box.place(relx=0.3, width=170, **place_op)
+        self.bulk_value.place(relx=0.47, width=190, **place_op)
+        apply_btn.place(relx=0.65, width=220, **place_op)
+
+    def confirm_bulk_edit(self):
+        column = self.bulk_column.get()
+        value = self.bulk_value.get()
+        if not column:
+            messagebox.showwarning(title="Input error",
+                                   message="Please select a column to change")
+            return
+        if column == "Rating":
+            try:
+                value = float(value)
+            except ValueError:
+                messagebox.showwarning(title="Input error",
+                                       message="Rating must be a number")
+                return
+        count = len(self.table.frame)
+        if not messagebox.askyesno(title="Apply to all shown",
+                                   message=f"Set {column} to {value!r} "
+                                           f"for {count} books?"):
+            return
+        predicate = self.predicate
+        self.progress_task(lambda: self.database.bulk_update(predicate, {column: value}),
+                           on_done=self.bulk_edit_done)
+
+    def bulk_edit_done(self, changed):
+        self.bulk_value.delete(0, END)
+        if self.filterby.get():
+            values = self.database.all_filterable_book(self.filterby.get())
+            self.detail_box.config(values=sorted(values, key=str))
+        self.refresh_table()
+        messagebox.showinfo(title="Apply to all shown",
+                            message=f"{changed} books changed")
+
     def reset(self):
         self.filterby.set('Author')
 
@@ -1157,12 +1511,11 @@ class BookStatisticPage(Page):
         place_op = {"anchor": 'e', "height": 40, "rely": 0.285}
         self.graph_box.place(relx=0.535, width=290, **place_op)
         self.detail_box.place(relx=0.775, width=200, **place_op)
-        self.graph_name.trace("w",
-                              lambda *args: self.change_graph_type(self.graph_name.get()))
-        self.detail_name.trace("w", lambda *args: self.change_graph_type(
-            self.graph_name.get()))
+        self.trace_refresh(self.graph_name, "plot", self.plot_graph)
+        self.trace_refresh(self.detail_name, "plot", self.plot_graph)
 
-    def change_graph_type(self, graph_name):
+    def plot_graph(self):
+        graph_name = self.graph_name.get()
         if graph_name == "total number of books":
             self.plot_total_graph(self.detail_name.get())
         elif graph_name == "average of rating":
@@ -1171,38 +1524,24 @@ class BookStatisticPage(Page):
     def init_graph(self):
         self.graph_frame = Frame(self, width=560, height=400)
         self.graph_frame.place(relx=0.5, rely=0.626, anchor="center")
-        self.fig = Figure()
-        self.axes = self.fig.add_subplot()
-        self.fig_canvas = FigureCanvasTkAgg(self.fig, master=self.graph_frame)
+        self.chart = ChartView(self.graph_frame)
         graph_place = {"anchor": 'center',
                        "width": 560, "height": 400,
                        "rely": 0.5, "relx": 0.5}
-        self.fig_canvas.get_tk_widget().place(**graph_place)
+        self.chart.widget().place(**graph_place)
 
     def plot_rating_graph(self, detail):
-        self.axes.clear()
-        df = self.database.bookdf[['Rating', detail]].groupby(detail).mean()
-        sns.set(style="darkgrid")
-        sns.set_palette("BrBG_r")
-        df.plot.bar(title=f'The graph of average of rating in each '
-                          f'{detail.lower()}',
-                    ylim=[self.database.bookdf.Rating.min() - 0.3, 5],
-                    ax=self.axes)
-        self.fig.autofmt_xdate(ha="center", rotation=30)
-        self.fig_canvas.draw()
+        df = self.database.aggregate("mean_rating", detail)
+        low = df.min() - 0.3 if len(df) else 0
+        self.chart.show_bars(df, title=f'The graph of average of rating in each '
+                                       f'{detail.lower()}',
+                             ylim=(low, 5), label="Rating")
 
     def plot_total_graph(self, detail):
-        self.axes.clear()
-        df = self.database.bookdf.groupby(detail).size()
-        sns.set()
-        sns.set_palette("BrBG_r")
-        df.plot(kind='pie',
-                title=f'The graph of total number of books in each {detail.lower()}',
-                label="",
-                autopct=lambda p: f'{p:.2f}%({(p / 100) * df.sum():.0f})',
-                ax=self.axes)
-        self.fig.autofmt_xdate(rotation=30)
-        self.fig_canvas.draw()
+        df = self.database.aggregate("count", detail)
+        self.chart.show_pie(df, title=f'The graph of total number of books in '
+                                      f'each {detail.lower()}',
+                            autopct=lambda p: f'{p:.2f}%({(p / 100) * df.sum():.0f})')
 
     def reset(self):
         self.detail_name.set(self.plotable_list[0])
@@ -0,0 +1,89 @@
+import base64
+import os
+from collections import OrderedDict
+from io import BytesIO
+from tkinter import PhotoImage, TclError
+
+DEFAULT_COVER = r"picApp/cover/default_cover.png"
+
+
+class CoverCache:
+    """ Decoded cover images shared by every page.
+
+    Images are keyed by path and modification time, so a cover replaced
+    on disk is decoded again, and the least recently shown ones are
+    dropped once the decoded pixels go over max_bytes. With thumbnails
+    the pre-scaled cover is decoded instead of the full-size file when
+    it's ready. PhotoImage is a Tk object, use it from the main thread
+    only.
+    """
+
+    def __init__(self, master, max_bytes=64 * 1024 * 1024, thumbnails=None):
+        self.master = master
+        self.max_bytes = max_bytes
+        self.thumbnails = thumbnails
+        self.images = OrderedDict()     # (path, mtime) -> PhotoImage
+        self.keys = {}                  # path -> its current key
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def image_bytes(image):
+        # Tk keeps 4 bytes per pixel
+        return image.width() * image.height() * 4
+
+    def get(self, cover, default=DEFAULT_COVER):
+        """ Return the PhotoImage for cover, or default's if it can't be read """
+        try:
+            return self.load(cover or default)
+        except (OSError, TclError):
+            return self.load(default)
+
+    def load(self, path):
+        path = os.path.normpath(path)
+        if self.thumbnails is not None and os.path.exists(path):
+            path = self.thumbnails.path(path, "cover")
+        key = (path, os.path.getmtime(path))
+        if key in self.images:
+            self.hits += 1
+            self.images.move_to_end(key)
+            return self.images[key]
+        self.misses += 1
+        if path in self.keys:
+            # the file changed since it was decoded
+            self.discard(self.keys[path])
+        try:
+            image = PhotoImage(master=self.master, file=path)
+        except TclError:
+            image = self.pillow_image(path)
+        self.images[key] = image
+        self.keys[path] = key
+        self.size += self.image_bytes(image)
+        # labels showing an evicted image keep it alive through their .img
+        while self.size > self.max_bytes and len(self.images) > 1:
+            self.discard(next(iter(self.images)))
+        return image
+
+    def pillow_image(self, path):
+        """ Decode what Tk can't read itself (JPEG, WebP...) with Pillow """
+        try:
+            from PIL import Image
+        except ImportError:
+            raise TclError(f"can't read {path} without Pillow")
+        buffer = BytesIO()
+        with Image.open(path) as picture:
+            picture.save(buffer, "PNG")
+        return PhotoImage(master=self.master,
+                          data=base64.b64encode(buffer.getvalue()))
+
+    def discard(self, key):
+        image = self.images.pop(key)
+        self.size -= self.image_bytes(image)
+        if self.keys.get(key[0]) == key:
+            del self.keys[key[0]]
+
+    def info(self):
+        return {"images": len(self.images), "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,106 @@
+import hashlib
+import os
+import re
+from threading import Lock
+from cover_cache import DEFAULT_COVER
+
+COVER_DIR = "picApp/cover"
+
+
+class CoverStore:
+    """ Cover images kept once per content.
+
+    An ingested image is stored as <md5 of its bytes>.png in directory
+    and the sheet's Cover column holds just the hash, so volumes of a
+    series sharing a cover share one file (and one decoded image).
+    The covers already in directory have names that aren't their MD5,
+    they're hashed once when the store is first used and a picked image
+    with the same content is kept as that file. Older rows that hold a
+    path like picApp/cover/<name>.png still work.
+    """
+    hash_pattern = re.compile(r"[0-9a-f]{32}")
+
+    def __init__(self, directory=COVER_DIR):
+        self.directory = directory
+        self.files = None       # {md5: file with that content}
+        self.lock = Lock()
+
+    def is_hash(self, cover):
+        return bool(self.hash_pattern.fullmatch(str(cover)))
+
+    def path(self, cover):
+        """ The file to show for a Cover value, a hash or a legacy path """
+        if not isinstance(cover, str) or not cover:
+            return DEFAULT_COVER
+        if self.is_hash(cover):
+            path = os.path.join(self.directory, f"{cover}.png")
+            if not os.path.exists(path):
+                # a cover that was in the store under another name
+                path = self.stored_files().get(cover, path)
+            return path
+        return cover
+
+    def stored_files(self):
+        """ {md5: path} of every cover in the directory, hashed once """
+        with self.lock:
+            if self.files is None:
+                files = {}
+                names = os.listdir(self.directory) if os.path.isdir(self.directory) else []
+                for name in sorted(names):
+                    path = os.path.join(self.directory, name)
+                    if not name.endswith(".png") or not os.path.isfile(path):
+                        continue
+                    with open(path, "rb") as file:
+                        digest = self.content_hash(file.read())
+                    if digest not in files or name == f"{digest}.png":
+                        files[digest] = path
+                self.files = files
+            return self.files
+
+    @staticmethod
+    def content_hash(data):
+        return hashlib.md5(data).hexdigest()
+
+    def ingest(self, source):
+        """ Store the image at source if it isn't stored yet, return its hash """
+        with open(source, "rb") as file:
+            data = file.read()
+        if not data.startswith(b"\x89PNG"):
+            # Tk only shows PNG and GIF, store everything else as PNG
+            data = self.to_png(source)
+        digest = self.content_hash(data)
+        if os.path.exists(self.stored_files().get(digest, "")):
+            return digest
+        target = os.path.join(self.directory, f"{digest}.png")
+        os.makedirs(self.directory, exist_ok=True)
+        temp = f"{target}.{os.getpid()}.tmp"
+        with open(temp, "wb") as file:
+            file.write(data)
+        os.replace(temp, target)
+        with self.lock:
+            self.files[digest] = target
+        return digest
+
+    @staticmethod
+    def to_png(source):
+        from io import BytesIO
+        from PIL import Image
+        buffer = BytesIO()
+        with Image.open(source) as image:
+            image.save(buffer, "PNG", optimize=True)
+        return buffer.getvalue()
+
+    def cover_value(self, cover):
+        """ What to write in the Cover column for what the user picked:
+        the content hash of any image, stored if the store doesn't have
+        it yet. The default cover and a missing file give the default
+        cover's path. """
+        if not isinstance(cover, str) or not cover:
+            return DEFAULT_COVER
+        if self.is_hash(cover):
+            return cover
+        if not os.path.isfile(cover) or \
+                os.path.abspath(cover) == os.path.abspath(DEFAULT_COVER):
+            return DEFAULT_COVER
+        return self.ingest(cover)
+
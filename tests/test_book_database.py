@@ -0,0 +1,194 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from book_database import BookDatabase, Eq
+from book_storage import SQLiteBackend
+
+
+class BumpingBackend(SQLiteBackend):
+    """ SQLite whose revision also moves with its own writes, the way
+    Google sheet's does """
+    own_writes_bump_revision = True
+
+    def revision(self):
+        with self.lock:
+            version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            return version, self.connection.total_changes
+
+
+def counted(name):
+    def call(self, *args, **kwargs):
+        self.reads += 1
+        return getattr(SQLiteBackend, name)(self, *args, **kwargs)
+    return call
+
+
+class CountingBackend(SQLiteBackend):
+    """ SQLite counting the calls that read the sheet """
+    reads = 0
+    fetch = counted("fetch")
+    revision = counted("revision")
+    read_rows = counted("read_rows")
+    read_column = counted("read_column")
+
+
+class DatabaseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open(self, backend=SQLiteBackend, **options):
+        return BookDatabase(None, "books", "Sheet1",
+                            storage=backend(self.directory), **options)
+
+    def add(self, database, count):
+        return database.add_books([{"nameTH": f"book {number}", "status": "Reading"}
+                                   for number in range(count)])
+
+
+class RevisionTest(DatabaseTest):
+    def test_edit_after_our_write_is_seen(self):
+        ours = self.open(BumpingBackend)
+        self.add(ours, 3)
+        theirs = self.open(BumpingBackend)
+        ours.edit_fields(1, {"Status": "Ours"})
+        theirs.edit_fields(2, {"Status": "Theirs"})
+        ours.update_df()
+        self.assertEqual(ours.bookdf["Status"].tolist(), ["Ours", "Theirs", "Reading"])
+
+
+class AppendTest(DatabaseTest):
+    def test_add_reads_nothing(self):
+        database = self.open(CountingBackend)
+        self.add(database, 2)
+        database.storage.reads = 0
+        self.assertEqual(self.add(database, 1), ["003"])
+        self.assertEqual(database.storage.reads, 0)
+
+    def test_both_copies_keep_their_books(self):
+        ours = self.open()
+        self.add(ours, 1)
+        theirs = self.open()
+        ours.add_books([{"nameTH": "ours"}])
+        theirs.add_books([{"nameTH": "theirs"}])
+        sheet = self.open().bookdf
+        self.assertEqual(sheet["Manga's Name (TH.)"].tolist(), ["book 0", "ours", "theirs"])
+        self.assertEqual(sheet["BookID"].tolist(), [1, 2, 3])
+        self.assertEqual(theirs.bookdf["BookID"].tolist(), [1, 2, 3])
+
+
+
+class DeltaSyncTest(DatabaseTest):
+    def test_edit_is_merged_without_a_fetch(self):
+        ours = self.open(delta_sync=True)
+        self.add(ours, 5)
+        theirs = self.open(delta_sync=True)
+        ours.edit_fields(3, {"Status": "Finished"})
+        theirs.update_df()
+        self.assertEqual(theirs.delta_merges, 1)
+        self.assertEqual(theirs.bookdf["Status"].tolist(),
+                         ["Reading", "Reading", "Finished", "Reading", "Reading"])
+
+    def test_new_books_keep_their_rows_past_a_deleted_one(self):
+        ours = self.open(delta_sync=True)
+        self.add(ours, 5)
+        theirs = self.open(delta_sync=True)
+        ours.add_books([{"nameTH": "six"}, {"nameTH": "seven"}])
+        ours.delete_book(6)
+        theirs.update_df()
+        self.assertEqual(theirs.delta_merges, 1)
+        self.assertEqual(theirs.bookdf.index.tolist(), [0, 1, 2, 3, 4, 6])
+        self.assertEqual(theirs.label_of(7), ours.label_of(7))
+        self.assertEqual(theirs.next_row(), ours.next_row())
+        theirs.add_books([{"nameTH": "eight"}])
+        sheet = self.open().bookdf
+        self.assertEqual(sheet["BookID"].tolist(), [1, 2, 3, 4, 5, 7, 8])
+        self.assertEqual(sheet.index.tolist(), [0, 1, 2, 3, 4, 6, 7])
+
+
+class CompactTest(DatabaseTest):
+    def test_compact_removes_the_blank_rows(self):
+        database = self.open()
+        self.add(database, 5)
+        database.delete_book(2)
+        database.delete_book(3)
+        self.assertEqual(database.compact(), 2)
+        sheet = self.open().bookdf
+        self.assertEqual(sheet["BookID"].tolist(), [1, 4, 5])
+        self.assertEqual(sheet.index.tolist(), [0, 1, 2])
+        self.assertEqual(database.label_of(4), 1)
+
+    def test_copy_behind_a_compact_edits_the_right_book(self):
+        ours = self.open()
+        self.add(ours, 5)
+        theirs = self.open()
+        ours.delete_book(2)
+        ours.compact()
+        theirs.edit_fields(4, {"Status": "Finished"})
+        theirs.delete_book(5)
+        sheet = self.open().bookdf
+        self.assertEqual(sheet[["BookID", "Status"]].values.tolist(),
+                         [[1, "Reading"], [3, "Reading"], [4, "Finished"]])
+
+    def test_stale_compact_leaves_new_books(self):
+        ours = self.open(cache_ttl=600)
+        self.add(ours, 3)
+        theirs = self.open()
+        ours.delete_book(3)
+        theirs.update_df()
+        theirs.add_books([{"nameTH": "theirs"}])
+        ours.compact()
+        sheet = self.open().bookdf
+        self.assertEqual(sheet["Manga's Name (TH.)"].tolist(), ["book 0", "book 1", "theirs"])
+
+
+class ThreadTest(DatabaseTest):
+    def test_shown_frame_stays_as_it_was(self):
+        database = self.open()
+        self.add(database, 3)
+        shown = database.bookdf
+        database.edit_fields(2, {"Status": "Finished", "Publisher": "New"})
+        database.add_books([{"nameTH": "added"}])
+        self.assertEqual(shown["Status"].tolist(), ["Reading"] * 3)
+        self.assertEqual(len(shown), 3)
+        self.assertEqual(database.bookdf["Status"].tolist(),
+                         ["Reading", "Finished", "Reading", ""])
+
+    def test_pages_read_while_the_worker_writes(self):
+        database = self.open()
+        self.add(database, 50)
+        errors = []
+
+        def write():
+            try:
+                for number in range(40):
+                    database.add_books([{"nameTH": f"new {number}",
+                                         "publisher": f"P{number}"}])
+                    database.edit_fields(number + 1, {"Status": f"S{number}"})
+            except Exception as error:
+                errors.append(error)
+
+        worker = threading.Thread(target=write)
+        worker.start()
+        while worker.is_alive():
+            database.search("Manga's Name (TH.)", "new")
+            database.aggregate("count", "Publisher")
+            database.aggregate("count", "Status")
+            database.query(Eq("Status", "Reading"))
+            database.find_book("BookID", 3)
+        worker.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(database.aggregate("count", "Status")["S39"], 1)
+        self.assertEqual(len(database.search("Manga's Name (TH.)", "new", limit=100)), 40)
+
+if __name__ == "__main__":
+    unittest.main()
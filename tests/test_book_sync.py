@@ -0,0 +1,98 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from book_database import BookDatabase
+from book_storage import SQLiteBackend
+from book_sync import SyncedBackend
+
+
+def unless_down(name):
+    def call(self, *args, **kwargs):
+        if self.down:
+            raise OSError("Unable to find the server")
+        return getattr(SQLiteBackend, name)(self, *args, **kwargs)
+    return call
+
+
+class UnreachableBackend(SQLiteBackend):
+    """ SQLite that fails like a sheet without internet while down is set """
+    down = False
+    open = unless_down("open")
+    fetch = unless_down("fetch")
+    revision = unless_down("revision")
+    read_rows = unless_down("read_rows")
+    update_rows = unless_down("update_rows")
+
+
+class OfflineTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.remote = UnreachableBackend(self.directory)
+        database = BookDatabase(None, "books", "Sheet1", storage=self.remote)
+        database.add_books([{"nameTH": f"book {number}", "status": "Reading"}
+                            for number in range(3)])
+        self.opened = []
+
+    def tearDown(self):
+        for database in self.opened:
+            database.storage.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def open(self):
+        storage = SyncedBackend(self.remote, os.path.join(self.directory, "sync"))
+        database = BookDatabase(None, "books", "Sheet1", storage=storage)
+        self.opened.append(database)
+        return database
+
+    def wait_for_sync(self, database, timeout=10):
+        end = time.monotonic() + timeout
+        while database.pending_writes() and time.monotonic() < end:
+            time.sleep(0.05)
+        return database.pending_writes()
+
+    def sheet(self):
+        database = BookDatabase(None, "books", "Sheet1",
+                                storage=SQLiteBackend(self.directory))
+        return database.bookdf[["BookID", "Status"]].values.tolist()
+
+    def test_edit_and_delete_reach_the_sheet(self):
+        database = self.open()
+        database.edit_fields(1, {"Status": "Finished"})
+        database.delete_book(2)
+        self.assertEqual(self.wait_for_sync(database), 0)
+        self.assertEqual(self.sheet(), [[1, "Finished"], [3, "Reading"]])
+
+    def test_start_from_snapshot_with_writes_waiting(self):
+        database = self.open()
+        self.remote.down = True
+        database.edit_fields(1, {"Status": "Finished"})
+        database.delete_book(2)
+        database.storage.close()
+        self.assertEqual(database.pending_writes(), 2)
+
+        database = self.open()
+        self.assertEqual(database.bookdf[["BookID", "Status"]].values.tolist(),
+                         [[1, "Finished"], [3, "Reading"]])
+        self.remote.down = False
+        database.storage.worker.wake()
+        self.assertEqual(self.wait_for_sync(database), 0)
+        self.assertEqual(self.sheet(), [[1, "Finished"], [3, "Reading"]])
+
+
+    def test_sheet_never_opened_offline_keeps_the_open_one(self):
+        database = self.open()
+        self.remote.down = True
+        with self.assertRaises(OSError):
+            database.update_sheet(worksheet="Sheet2")
+        self.assertEqual(database.storage.sheet, ("books", "Sheet1"))
+        self.assertEqual(database.worksheet_name, "Sheet1")
+
+if __name__ == "__main__":
+    unittest.main()
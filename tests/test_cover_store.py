@@ -0,0 +1,61 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+try:
+    from cover_store import CoverStore
+except ImportError:
+    # cover_cache needs tkinter
+    raise unittest.SkipTest("tkinter isn't installed")
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"cover pixels"
+
+
+class CoverStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.store_directory = os.path.join(self.directory, "cover")
+        os.makedirs(self.store_directory)
+        # named like the covers already in picApp/cover, not by MD5
+        self.legacy = self.write(self.store_directory, "0" * 32 + ".png")
+        self.store = CoverStore(self.store_directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    @staticmethod
+    def write(directory, name, data=PNG):
+        path = os.path.join(directory, name)
+        with open(path, "wb") as file:
+            file.write(data)
+        return path
+
+    def test_copy_of_a_stored_cover_is_kept_once(self):
+        copy = self.write(self.directory, "picked.png")
+        digest = self.store.cover_value(copy)
+        self.assertEqual(digest, hashlib.md5(PNG).hexdigest())
+        self.assertEqual(os.listdir(self.store_directory), [os.path.basename(self.legacy)])
+        self.assertEqual(self.store.path(digest), self.legacy)
+
+    def test_cover_in_the_store_gets_its_hash(self):
+        digest = self.store.cover_value(self.legacy)
+        self.assertEqual(digest, hashlib.md5(PNG).hexdigest())
+        self.assertEqual(self.store.path(digest), self.legacy)
+
+    def test_new_image_is_stored_by_hash(self):
+        data = PNG + b" another"
+        digest = self.store.cover_value(self.write(self.directory, "new.png", data))
+        path = self.store.path(digest)
+        self.assertEqual(os.path.basename(path), f"{hashlib.md5(data).hexdigest()}.png")
+        with open(path, "rb") as file:
+            self.assertEqual(file.read(), data)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules the pages import when they're first used, never at startup
+HEAVY = ["pandas", "matplotlib", "seaborn", "pandastable"]
+# seconds, BOOK_IMPORT_BUDGET overrides it for slow machines
+BUDGET = float(os.environ.get("BOOK_IMPORT_BUDGET", "1.0"))
+
+
+def import_times(module):
+    """ {module: cumulative microseconds} from python -X importtime """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    times = {}
+    top_level = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line.split("|")
+        if not parts[1].strip().isdigit():
+            # the header line
+            continue
+        name = parts[2][1:]
+        if not name.startswith(" "):
+            top_level += int(parts[1])
+        times[name.strip()] = int(parts[1])
+    return times, top_level
+
+
+class StartupImportTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        try:
+            import tkinter
+        except ImportError:
+            raise unittest.SkipTest("tkinter isn't installed")
+        cls.times, cls.total = import_times("book_ui")
+
+    def test_heavy_modules_are_deferred(self):
+        loaded = [module for module in HEAVY if module in self.times]
+        self.assertEqual(loaded, [], "imported while starting up")
+
+    def test_import_time_budget(self):
+        self.assertLess(self.total / 1e6, BUDGET,
+                        f"importing book_ui took {self.total / 1e6:.2f}s")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,154 @@
+import argparse
+import glob
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+# (width, height) each place shows a cover at, images keep their aspect
+SIZES = {"cover": (533, 356), "grid": (160, 160), "row": (32, 32)}
+# the cover label shows the middle of a bigger image at full size, so its
+# thumbnail is that same middle part and a cover looks the same whether
+# the thumbnail is made yet or not
+CROPPED = {"cover"}
+THUMBNAIL_DIR = ".thumbnails"
+
+
+def thumbnail_path(source, size_name, directory=THUMBNAIL_DIR):
+    """ Where the size_name thumbnail of source is kept, a new size or
+    crop gets new files instead of reusing the old ones """
+    width, height = SIZES[size_name]
+    key = f"{os.path.abspath(source)}|{width}x{height}|{size_name in CROPPED}"
+    name = hashlib.md5(key.encode("utf-8")).hexdigest()
+    return os.path.join(directory, size_name, f"{name}.png")
+
+
+def crop_middle(image, size):
+    """ The part of image a label of size shows, centered like Tk does """
+    width = min(size[0], image.width)
+    height = min(size[1], image.height)
+    left = (image.width - width) // 2
+    top = (image.height - height) // 2
+    return image.crop((left, top, left + width, top + height))
+
+
+def is_fresh(source, thumb):
+    """ A thumbnail older than its source was made from an old image """
+    try:
+        return os.path.getmtime(thumb) >= os.path.getmtime(source)
+    except OSError:
+        return False
+
+
+def make_thumbnail(source, size_name, directory=THUMBNAIL_DIR):
+    """ Scale source down to size_name and save it as a compressed PNG.
+    Runs in a worker process, returns the thumbnail's path. """
+    from PIL import Image
+    thumb = thumbnail_path(source, size_name, directory)
+    os.makedirs(os.path.dirname(thumb), exist_ok=True)
+    with Image.open(source) as image:
+        if size_name in CROPPED:
+            image = crop_middle(image, SIZES[size_name])
+        else:
+            image.thumbnail(SIZES[size_name], Image.LANCZOS)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA")
+        # write then rename so the UI never reads half a file
+        temp = f"{thumb}.{os.getpid()}.tmp"
+        image.save(temp, "PNG", optimize=True)
+    os.replace(temp, thumb)
+    return thumb
+
+
+class Thumbnails:
+    """ Pre-scaled covers generated in a process pool.
+
+    path() hands back the thumbnail when it's up to date, otherwise it
+    queues one and returns the source so the caller can show that
+    meanwhile. Without Pillow the sources are always used.
+    """
+
+    def __init__(self, directory=THUMBNAIL_DIR, max_workers=None):
+        self.directory = directory
+        self.max_workers = max_workers
+        self.pool = None
+        self.pending = {}       # (source, size_name) -> Future
+        try:
+            import PIL
+            self.enabled = True
+        except ImportError:
+            self.enabled = False
+
+    def path(self, source, size_name="cover"):
+        if not self.enabled:
+            return source
+        thumb = thumbnail_path(source, size_name, self.directory)
+        if is_fresh(source, thumb):
+            return thumb
+        self.generate([source], size_name)
+        return source
+
+    def generate(self, sources, size_name="cover"):
+        """ Queue thumbnails for sources, returns their futures """
+        if self.pool is None:
+            # forking the Tk process with its threads running isn't safe
+            self.pool = ProcessPoolExecutor(max_workers=self.max_workers,
+                                            mp_context=get_context("spawn"))
+        futures = []
+        for source in sources:
+            key = (source, size_name)
+            if key not in self.pending or self.pending[key].done():
+                self.pending[key] = self.pool.submit(make_thumbnail, source,
+                                                     size_name, self.directory)
+                self.pending[key].add_done_callback(
+                    lambda done, key=key: self.forget(key, done))
+            futures.append(self.pending[key])
+        return futures
+
+    def forget(self, key, future):
+        if self.pending.get(key) is future:
+            del self.pending[key]
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Make the cover thumbnails ahead of time")
+    parser.add_argument("sources", nargs="*", default=["picApp/cover"],
+                        help="cover images or folders of them")
+    parser.add_argument("--size", action="append", choices=sorted(SIZES),
+                        help="sizes to make, all of them by default")
+    parser.add_argument("--directory", default=THUMBNAIL_DIR)
+    parser.add_argument("--force", action="store_true",
+                        help="remake thumbnails that are up to date")
+    args = parser.parse_args()
+
+    files = []
+    for source in args.sources:
+        if os.path.isdir(source):
+            files += sorted(glob.glob(os.path.join(source, "*.png")))
+        else:
+            files.append(source)
+    jobs = [(source, size_name) for size_name in args.size or sorted(SIZES)
+            for source in files
+            if args.force or not is_fresh(
+                source, thumbnail_path(source, size_name, args.directory))]
+    with ProcessPoolExecutor() as pool:
+        futures = [pool.submit(make_thumbnail, source, size_name, args.directory)
+                   for source, size_name in jobs]
+        failed = 0
+        for (source, size_name), future in zip(jobs, futures):
+            try:
+                future.result()
+            except Exception as error:
+                failed += 1
+                print(f"{source} ({size_name}): {error}")
+    print(f"Made {len(jobs) - failed} thumbnails, "
+          f"{len(files) * len(args.size or SIZES) - len(jobs)} were up to date")
+
+
+if __name__ == "__main__":
+    main()